@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# Runs the complete pipeline (trim, imgseries, crop, scale, hough, stitch,
+# average, merge) for many videos. Every flight gets its own directory inside
+# of the output directory. Stages are run as separate processes of the
+# respective scripts, flights are processed in parallel by a pool of workers.
+
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent import futures
+
+import pandas as pd
+from tqdm import tqdm
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(BASE, 'stitch'))
+import framestore as fs
+
+# manifest columns that can override the defaults per flight
+OPTIONS = ['start', 'end', 'fps', 'north', 'south', 'east', 'west', 'scale',
+           'threshold', 'max_v_deviation', 'method']
+
+# stages that can pick up the results of an interrupted attempt
+RESUMABLE = ['hough', 'stitch']
+
+
+def script(*path):
+    return [sys.executable, os.path.join(BASE, *path)]
+
+
+def limits(cpu_time=None, memory=None):
+    """
+    Returns a function that applies the given limits of CPU seconds
+    and megabytes of address space to the process it is called in.
+    """
+    def apply():
+        if cpu_time:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time))
+        if memory:
+            size = memory * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    return apply
+
+
+def stages(video, flightdir, options, cpus):
+    """
+    Yields the stages of the pipeline for one flight as (name, command).
+    Commands are lists of arguments, or functions returning them
+    for stages that depend on the results of earlier ones.
+    """
+    path = lambda *p: os.path.join(flightdir, *p)
+
+    if options['start'] or options['end']:
+        trimmed = path('trimmed' + os.path.splitext(video)[1])
+        command = script('pre', 'trim.py') + [video, '-o', trimmed]
+        if options['start']:
+            command += ['-s', str(int(options['start']))]
+        if options['end']:
+            command += ['-e', str(int(options['end']))]
+        yield 'trim', command
+        video = trimmed
+
+    images = path('frames')
+    yield ('imgseries',
+           script('pre', 'imgseries.py') + [video, '-o', images, '--fps', str(options['fps'])])
+
+    borders = [int(options[side] or 0) for side in ['north', 'south', 'east', 'west']]
+    if any(borders):
+        cropped = path('cropped')
+        os.makedirs(cropped, exist_ok=True)
+        yield ('crop',
+               script('pre', 'crop.py') + [images, '-o', cropped]
+               + [arg for flag, border in zip(['-n', '-s', '-e', '-w'], borders)
+                  for arg in [flag, str(border)]])
+        images = cropped
+
+    if options['scale'] != 1:
+        scaled = path('scaled')
+        os.makedirs(scaled, exist_ok=True)
+        yield ('scale',
+               script('pre', 'scale.py') + [images, str(options['scale']), '-o', scaled])
+        images = scaled
+
+    hough = path('hough.csv')
+    command = script('stitch', 'hough.py') + [images, '-o', hough,
+                                              '-t', str(int(options['threshold'])),
+                                              '--max-workers', str(cpus)]
+    if options['max_v_deviation']:
+        command += ['-d', str(options['max_v_deviation'])]
+    yield 'hough', command
+
+    def stitch_command():
+        # the image height is only known once the images exist
+        first = sorted(fs.listdir(images))[0]
+        height = fs.imread(os.path.join(images, first)).shape[0]
+        return script('stitch', 'stitch.py') + [options['method'], hough, images, str(height),
+                                                '-l', str(options['local_optimization']),
+                                                '-o', translations]
+    translations = path('translations.csv')
+    yield 'stitch', stitch_command
+
+    averaged = path('translations_averaged.csv')
+    yield ('average',
+           script('post', 'average.py') + [translations, '-o', averaged,
+                                           '-s', str(options['window_size'])])
+
+    panorama = path('panorama.png')
+    yield 'merge', script('post', 'merge.py') + [averaged, images, panorama]
+
+
+def run_flight(name, video, flightdir, options, cpus=1, memory=None, cpu_time=None,
+               retries=2, force=False):
+    """
+    Runs all stages for one flight, retrying failed stages. Stages that
+    succeeded in an earlier run are skipped unless `force` is set.
+    Returns a dict summarizing the run.
+    """
+    os.makedirs(os.path.join(flightdir, '.done'), exist_ok=True)
+    # limit the number of threads of the numerical libraries to the share of this flight
+    env = dict(os.environ, **{var: str(cpus) for var in
+                              ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                               'NUMBA_NUM_THREADS']})
+    summary = {'flight': name, 'status': 'done', 'failed_stage': None,
+               'retries': 0, 'seconds': 0.0}
+
+    with open(os.path.join(flightdir, 'log.txt'), 'a') as log:
+        for stage, command in stages(video, flightdir, options, cpus):
+            marker = os.path.join(flightdir, '.done', stage)
+            if os.path.isfile(marker) and not force:
+                continue
+
+            start = time.time()
+            for attempt in range(retries + 1):
+                if attempt > 0:
+                    summary['retries'] += 1
+                    log.write('Retrying ' + stage + ' (attempt ' + str(attempt + 1) + ')\n')
+                try:
+                    args = command() if callable(command) else command
+                    if attempt > 0 and stage in RESUMABLE:
+                        args = args + ['--resume']
+                    log.write('$ ' + ' '.join(args) + '\n')
+                    log.flush()
+                    returncode = subprocess.run(args, stdout=log, stderr=subprocess.STDOUT,
+                                                env=env, preexec_fn=limits(cpu_time, memory)
+                                                ).returncode
+                except Exception as e:
+                    log.write('Failed to run ' + stage + ': ' + repr(e) + '\n')
+                    returncode = -1
+                if returncode == 0:
+                    break
+                log.write(stage + ' exited with code ' + str(returncode) + '\n')
+            summary[stage + '_seconds'] = round(time.time() - start, 1)
+            summary['seconds'] += time.time() - start
+
+            if returncode != 0:
+                summary['status'] = 'failed'
+                summary['failed_stage'] = stage
+                break
+            open(marker, 'w').close()
+
+    summary['seconds'] = round(summary['seconds'], 1)
+    return summary
+
+
+def read_manifest(manifest, defaults):
+    """
+    Reads a CSV file with one video per row in column `video`,
+    optionally a `name` per flight and any of the columns in `OPTIONS`.
+    Yields (name, video, options) where missing options are taken from `defaults`.
+    """
+    df = pd.read_csv(manifest)
+    directory = os.path.dirname(os.path.abspath(manifest))
+    for _, row in df.iterrows():
+        # relative paths are relative to the manifest
+        video = os.path.join(directory, row['video'])
+        if 'name' in row and not pd.isna(row['name']):
+            name = str(row['name'])
+        else:
+            name = os.path.splitext(os.path.basename(video))[0]
+        options = dict(defaults)
+        for option in OPTIONS:
+            if option in row and not pd.isna(row[option]):
+                options[option] = row[option]
+        yield name, video, options
+
+
+def batch(manifest, output, defaults, max_workers=2, cpus=1, memory=None, cpu_time=None,
+          retries=2, force=False):
+    """
+    Runs the pipeline for all flights of a manifest on a pool of workers
+    and writes a summary report to `output/summary.csv`.
+    """
+    flights = list(read_manifest(manifest, defaults))
+    names = [name for name, _, _ in flights]
+    if len(set(names)) < len(names):
+        print('Please provide unique names for all flights')
+        exit(3)
+
+    results = []
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as ex:
+        jobs = {ex.submit(run_flight, name, video, os.path.join(output, name), options,
+                          cpus=cpus, memory=memory, cpu_time=cpu_time,
+                          retries=retries, force=force): name
+                for name, video, options in flights}
+        for job in tqdm(futures.as_completed(jobs), total=len(jobs)):
+            try:
+                summary = job.result()
+            except Exception as e:
+                summary = {'flight': jobs[job], 'status': 'failed',
+                           'failed_stage': repr(e)}
+            if summary['status'] != 'done':
+                print('Flight', summary['flight'], 'failed at', summary['failed_stage'])
+            results.append(summary)
+
+    df = pd.DataFrame(results).set_index('flight').reindex(names)
+    summaryfile = os.path.join(output, 'summary.csv')
+    df.to_csv(summaryfile)
+    print(df[['status', 'failed_stage', 'retries', 'seconds']])
+    print('Done.', (df['status'] == 'done').sum(), 'of', len(df), 'flights succeeded.',
+          summaryfile)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('manifest',
+                        help='CSV file with a column video and optionally name, '
+                        + ', '.join(OPTIONS) + ' per flight')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output directory, receives one directory per flight')
+    parser.add_argument('-j', '--jobs', type=int, default=2,
+                        help='Number of flights to process in parallel')
+    parser.add_argument('-c', '--cpus', type=int, default=1,
+                        help='Number of threads per flight')
+    parser.add_argument('-m', '--memory', type=int,
+                        help='Maximum megabytes of address space per stage')
+    parser.add_argument('--cpu-time', type=int,
+                        help='Maximum CPU seconds per stage')
+    parser.add_argument('-r', '--retries', type=int, default=2,
+                        help='Number of retries of a failed stage')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Rerun stages that succeeded in an earlier run')
+
+    # defaults for all flights, can be overridden in the manifest
+    parser.add_argument('--start', type=int,
+                        help='Start of trimmed videos in seconds')
+    parser.add_argument('--end', type=int,
+                        help='End of trimmed videos in seconds')
+    parser.add_argument('--fps', default='1/2',
+                        help='Frames extracted per second of video')
+    parser.add_argument('-n', '--north', type=int, default=0,
+                        help='Trim from top')
+    parser.add_argument('-s', '--south', type=int, default=0,
+                        help='Trim from bottom')
+    parser.add_argument('-e', '--east', type=int, default=0,
+                        help='Trim from right')
+    parser.add_argument('-w', '--west', type=int, default=0,
+                        help='Trim from left')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='Scaling factor')
+    parser.add_argument('-t', '--threshold', type=int, default=80,
+                        help='Threshold to use for Hough transformation')
+    parser.add_argument('-d', '--max-v-deviation', type=float, default=0.3,
+                        help='Filter lines by their maximum deviation from the vertical line')
+    parser.add_argument('--method', choices=['analytical', 'iterative', 'phase'], default='iterative',
+                        help='Perform stitching in an analytical or iterative manner based on Hough lines, or by phase correlation of the images')
+    parser.add_argument('-l', '--local-optimization', type=int, default=20,
+                        help='Maximum L∞ radius of local optimization (regarded iff method=analytical)')
+    parser.add_argument('--window-size', type=int, default=5,
+                        help='Size of sliding window used for averaging translations')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.manifest):
+        print('Please provide a manifest file')
+        exit(1)
+
+    os.makedirs(args.output, exist_ok=True)
+    defaults = {option: getattr(args, option)
+                for option in OPTIONS + ['local_optimization', 'window_size']}
+    batch(args.manifest, args.output, defaults,
+          max_workers=args.jobs,
+          cpus=args.cpus,
+          memory=args.memory,
+          cpu_time=args.cpu_time,
+          retries=args.retries,
+          force=args.force)
@@ -2,13 +2,13 @@
 
 BASE=data/processed/dec19/kalkar1/thermal
 
-for count in {10,20,50,100,200,500,1000,5000}; do
-    for quality in {0.005,0.01,0.015,0.02,0.025,0.03,0.035,0.04,0.045,0.05,0.055,0.06,0.065,0.07,0.08,,0.09,0.1,0.2,0.5}; do
-        P=$BASE/eval/gftt/$count/$quality
-        mkdir -p $P/gftt
+# Detects features once per image and derives the results of all
+# combinations of count and quality, writing one row per combination.
+# Supply --hough <csv> to only detect features on the rotor blade.
 
-        echo "Count: $count | Quality: $quality >>> $P"
-        ./unused/gftt.py $BASE/data/ -o $P/gftt -c $count -q $quality -d 5 >$P/log.txt
+mkdir -p $BASE/eval/gftt
 
-    done
-done
+./unused/featuresweep.py gftt $BASE/data/ $BASE/eval/gftt/summary.csv -d 5 \
+    -c 10 20 50 100 200 500 1000 5000 \
+    -q 0.005 0.01 0.015 0.02 0.025 0.03 0.035 0.04 0.045 0.05 0.055 0.06 0.065 0.07 0.08 0.09 0.1 0.2 0.5 \
+    > $BASE/eval/gftt/log.txt
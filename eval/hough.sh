@@ -2,17 +2,13 @@
 
 BASE=data/processed/dec19/kalkar1/thermal
 
-# Note that you can use
-# for l in $(ls */*/log.txt);do echo $l,$(cat $l|grep "merely 0"|wc -l),$(cat $l|grep "merely 1"|wc -l),$(cat $l|grep "multiple"|wc -l);done
-# in order to accumulate the results into a csv file (filename,zero,one,multiple) when the WD is in $BASE/eval/hough
+# Performs the whole grid search in a single process,
+# writing $BASE/eval/hough/<threshold>/<maxvdev>/hough.csv per combination.
+# The number of images with zero or one lines and the number of lines similar
+# to multiple centers ("Found multiple lines similar to" in the logs of hough.py)
+# per combination are accumulated into $BASE/eval/hough/summary.csv
 
-for threshold in {50..250..10}; do
-    for maxvdev in {1..8}; do
-        P=$BASE/eval/hough/$threshold/$maxvdev
-        mkdir -p $P/hough
+mkdir -p $BASE/eval/hough
 
-        echo "Threshold: $threshold | Max dev: 0.$maxvdev >>> $P"
-        ./stitch/hough.py $BASE/data/ -p $P/hough -o $P/hough.csv -s center -t $threshold -d 0.$maxvdev --max-workers $(nproc) > $P/log.txt
-
-    done
-done
+./stitch/houghsweep.py $BASE/data/ $BASE/eval/hough -s center \
+    -t {50..250..10} -d 0.{1..8} --max-workers $(nproc) > $BASE/eval/hough/log.txt
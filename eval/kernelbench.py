@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import kernels
+import lineutils as ut
+
+# Compares the backends of `kernels.squared_errors` with the scalar
+# error function on random lines, and reports the time of the first call
+# (compilation or loading from cache) separately from the steady-state speed.
+
+
+def scalar_error(c_lines, n_lines, translation, image_height):
+    # the error function as computed line by line with `lineutils`
+    tx, ty = translation
+    error = 0
+    for c, n in zip(c_lines, n_lines):
+        c = ut.move_origin(c, x=tx, y=ty)
+        cb = ut.move_origin(c, y=image_height)
+        nb = ut.move_origin(n, y=image_height)
+        top = ut.root(n) - ut.root(c)
+        bottom = ut.root(nb) - ut.root(cb)
+        error += top * top + bottom * bottom
+    return error
+
+
+def random_lines(rng, count):
+    rho = rng.uniform(0, 400, count)
+    theta = rng.normal(0, 0.2, count) + rng.choice([0, np.pi], count)
+    c_lines = ut.LineSet.from_lines(zip(rho, theta))
+    n_lines = ut.LineSet.from_lines(zip(rho + rng.normal(5, 20, count),
+                                        theta + rng.normal(0, 0.01, count)))
+    return c_lines, n_lines
+
+
+def grid(radius):
+    xs, ys = zip(*[(x, y)
+                   for x in range(-radius, radius + 1)
+                   for y in range(-radius, radius + 1)])
+    return np.array(xs), np.array(ys)
+
+
+def evaluate(pairs, lines, radius, image_height, repeat):
+    rng = np.random.default_rng(0)
+    cases = [random_lines(rng, lines) for _ in range(pairs)]
+    xs, ys = grid(radius)
+    backends = ['numpy'] + (['numba'] if kernels.numba is not None else [])
+
+    print('Agreement with scalar error function on', pairs, 'pairs of',
+          lines, 'lines and', len(xs), 'translations each')
+    reference = [np.array([scalar_error(c, n, t, image_height) for t in zip(xs, ys)])
+                 for c, n in cases]
+    for backend in backends:
+        start = time.perf_counter()
+        results = [kernels.squared_errors(c.rho, c.theta, n.rho, n.theta, xs, ys,
+                                          image_height, backend=backend)
+                   for c, n in cases[:1]]
+        first = time.perf_counter() - start
+        results += [kernels.squared_errors(c.rho, c.theta, n.rho, n.theta, xs, ys,
+                                           image_height, backend=backend)
+                    for c, n in cases[1:]]
+        identical = sum(int((r == e).sum()) for r, e in zip(results, reference))
+        deviation = max(float(np.max(np.abs(r - e) / np.maximum(1, np.abs(e))))
+                        for r, e in zip(results, reference))
+        print('  {:6s} identical: {} of {}, max. relative deviation: {:.3g}, first call: {:.3f}s'
+              .format(backend, identical, len(xs) * pairs, deviation, first))
+
+    print('Steady-state time per pair of images (best of', repeat, 'runs)')
+    start = time.perf_counter()
+    for c, n in cases:
+        for t in zip(xs, ys):
+            scalar_error(c, n, t, image_height)
+    print('  {:6s} {:.6f}s'.format('scalar', (time.perf_counter() - start) / pairs))
+    for backend in backends:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for c, n in cases:
+                kernels.squared_errors(c.rho, c.theta, n.rho, n.theta, xs, ys,
+                                       image_height, backend=backend)
+            timings.append((time.perf_counter() - start) / pairs)
+        print('  {:6s} {:.6f}s'.format(backend, min(timings)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-p', '--pairs', type=int, default=20,
+                        help='Number of random pairs of images')
+    parser.add_argument('-n', '--lines', type=int, default=4,
+                        help='Number of lines per image')
+    parser.add_argument('-l', '--local-optimization', type=int, default=20,
+                        help='L∞ radius of translations to evaluate per pair')
+    parser.add_argument('--height', type=int, default=240,
+                        help='Image height')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timed runs per backend')
+
+    args = parser.parse_args()
+
+    evaluate(args.pairs, args.lines, args.local_optimization, args.height, args.repeat)
@@ -2,15 +2,14 @@
 
 BASE=data/processed/dec19/kalkar1/thermal
 
-for count in {0,10,20,50,100,200,500,1000,2000,5000,10000}; do
-    for ct in {1..9}; do
-        for et in {2..18..2}; do
-            P=$BASE/eval/sift/$count/$ct/$et
-            mkdir -p $P/sift
+# Detects features once per image and edge threshold and derives the results
+# of all combinations of count and contrast threshold, writing one row per combination.
+# Supply --hough <csv> to only detect features on the rotor blade.
 
-            echo "Count: $count | CT: 0.0$ct | ET: $et >>> $P"
-            ./unused/sift.py $BASE/data/ -o $P/sift -c $count --contrast-threshold 0.0$ct --edge-threshold $et > $P/log.txt
+mkdir -p $BASE/eval/sift
 
-        done
-    done
-done
+./unused/featuresweep.py sift $BASE/data/ $BASE/eval/sift/summary.csv \
+    -c 0 10 20 50 100 200 500 1000 2000 5000 10000 \
+    --contrast-thresholds 0.0{1..9} \
+    --edge-thresholds {2..18..2} \
+    > $BASE/eval/sift/log.txt
@@ -2,28 +2,31 @@
 # -*- coding: utf8 -*-
 
 from tqdm import tqdm
-import numpy as np
 import pandas as pd
 
 # Transform [(i,j,a),(i,j+1,b),(i+1,j,c),(i+1,j+1,d)] to [[a,b],[c,d]]
 
 
-def transform(filename, rows_idx, cols_idx, vals_idx, outfile):
+def transform(filename, rows_idx, cols_idx, vals_idx, outfile, chunksize=None):
     print('Reading data')
-    in_df = pd.read_csv(filename)
+    # only read the three columns of interest, addressed by their position
+    names = pd.read_csv(filename, nrows=0).columns
+    row_name, col_name, val_name = names[rows_idx], names[cols_idx], names[vals_idx]
+    reader = pd.read_csv(filename, usecols=[row_name, col_name, val_name],
+                         chunksize=chunksize)
+    if chunksize is None:
+        reader = [reader]
     print('Transforming')
-    raw = in_df.values
-    t = raw.transpose()
-    rows, cols = t[rows_idx], t[cols_idx]
-    row_index, col_index = set(rows), set(cols)
-    res = []
-    for i in tqdm(row_index):
-        row = []
-        for j in col_index:
-            val = raw[(rows == i) & (cols == j)][0][vals_idx]
-            row.append(val)
-        res.append(row)
-    out_df = pd.DataFrame(res, index=row_index, columns=col_index)
+    parts = []
+    for chunk in tqdm(reader):
+        # the first value per cell wins
+        parts.append(chunk.drop_duplicates(subset=[row_name, col_name]))
+    raw = pd.concat(parts).drop_duplicates(subset=[row_name, col_name])
+    out_df = (raw.pivot(index=row_name, columns=col_name, values=val_name)
+              .sort_index(axis=0)
+              .sort_index(axis=1))
+    out_df.index.name = None
+    out_df.columns.name = None
     print('Writing output file')
     out_df.to_csv(outfile)
     print('Done.', outfile)
@@ -40,7 +43,10 @@ if __name__ == '__main__':
     parser.add_argument('col', type=int, help='col name')
     parser.add_argument('val', type=int, help='val name')
     parser.add_argument('output', help='Output CSV')
+    parser.add_argument('--chunksize', type=int,
+                        help='Stream the input in chunks of this many lines')
 
     args = parser.parse_args()
 
-    transform(args.input, args.row, args.col, args.val, args.output)
+    transform(args.input, args.row, args.col, args.val, args.output,
+              chunksize=args.chunksize)
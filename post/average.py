@@ -25,9 +25,9 @@ def average(translations, output, window_size=5):
     ) for i in range(0, length))
 
     coords = ([
-        xs[file] if args.x_only else
-        ys[file] if args.y_only else
-        (xs[file], ys[file]) for file in window
+        xs.iloc[i] if args.x_only else
+        ys.iloc[i] if args.y_only else
+        (xs.iloc[i], ys.iloc[i]) for i in window
     ] for window in windows)
 
     avgs = (np.array(values).mean(0).astype(int)
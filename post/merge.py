@@ -2,60 +2,134 @@
 # -*- coding: utf8 -*-
 
 import cv2 as cv
+import numpy as np
 import pandas as pd
 import os
-
-
-def merge(offsetsfile, imagedir, outputfile):
+import sys
+from concurrent import futures
+from tqdm import tqdm
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+import pipeline as pl
+
+
+def layout(offsetsfile):
+    """
+    Follows the chain of translations from the first image on and returns
+    the images in order along with their positions relative to the first one
+    as a list of (file, x, y).
+    """
     df = pd.read_csv(offsetsfile, index_col=0)
     d = df.to_dict(orient='index')
 
     file_img = min(d.keys())
-    img = cv.imread(os.path.join(imagedir, file_img))
     current_x, current_y = 0, 0
-
-    while file_img in d:
+    frames = [(file_img, 0, 0)]
+    while file_img in d and len(frames) <= len(d):
         c = d[file_img]
-        x = c['x']
-        y = c['y']
-
-        file_ref = c['ref']
-        path_ref = os.path.join(imagedir, file_ref)
-        img_ref = cv.imread(path_ref)
-
+        file_ref, x, y = c['ref'], int(c['x']), int(c['y'])
         print(file_img, '->', file_ref, '|', x, y)
-
-        # w, h of current image
-        w_img, h_img = img.shape[1], img.shape[0]
-
-        # relative x, relative y, w, h of next image
-        x_ref, y_ref = current_x + x, current_y + y
-        w_ref, h_ref = img_ref.shape[1], img_ref.shape[0]
-
-        border_right = max(0, x_ref + w_ref - w_img)
-        border_bottom = max(0, y_ref + h_ref - h_img)
-
-        if x_ref < 0:
-            border_left = -x_ref
-            x_ref = 0
-        else:
-            border_left = 0
-
-        if y_ref < 0:
-            border_top = -y_ref
-            y_ref = 0
-        else:
-            border_top = 0
-
-        img = cv.copyMakeBorder(img,
-                                border_top, border_bottom, border_left, border_right,
-                                0)
-        img[y_ref:y_ref+h_ref, x_ref:x_ref+w_ref] = img_ref
-
-        current_x, current_y = x_ref, y_ref
+        current_x, current_y = current_x + x, current_y + y
+        frames.append((file_ref, current_x, current_y))
         file_img = file_ref
-
-    cv.imwrite(outputfile, img)
+    return frames
+
+
+def strips(height, width, strip_size, axis=None):
+    """
+    Splits a canvas into strips of `strip_size` pixels across the given axis
+    (0 for horizontal strips, 1 for vertical ones, by default the longer one)
+    and yields them as (y0, y1, x0, x1).
+    """
+    if axis is None:
+        axis = 0 if height >= width else 1
+    length = height if axis == 0 else width
+    for start in range(0, length, strip_size):
+        end = min(start + strip_size, length)
+        yield (start, end, 0, width) if axis == 0 else (0, height, start, end)
+
+
+def feather_weights(height, width):
+    """
+    Weights growing linearly with the distance from the closest image border.
+    """
+    ys = np.minimum(np.arange(1, height + 1), np.arange(height, 0, -1))
+    xs = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1))
+    return np.minimum.outer(ys, xs).astype(np.float32)
+
+
+def composite_strip(canvas, window, frames, imagedir, blend='none',
+                    prefetch=8, max_memory=512):
+    """
+    Composites the part `window` (y0, y1, x0, x1) of the canvas from the frames
+    (file, x, y, height, width) intersecting it. Without blending, later frames
+    are pasted over earlier ones. Otherwise, overlapping frames are averaged,
+    weighted by `feather_weights` if blend is 'feather'.
+    """
+    y0, y1, x0, x1 = window
+    frames = [(file, x, y, h, w) for file, x, y, h, w in frames
+              if x < x1 and x + w > x0 and y < y1 and y + h > y0]
+    out = canvas[y0:y1, x0:x1]
+    if blend != 'none':
+        total = np.zeros(out.shape, dtype=np.float32)
+        weight_sum = np.zeros(out.shape[:2] + (1,) * (out.ndim - 2), dtype=np.float32)
+
+    images = pl.prefetch([os.path.join(imagedir, file) for file, *_ in frames],
+                         depth=prefetch, max_memory=max_memory, workers=1)
+    for (file, x, y, h, w), (_, img) in zip(frames, images):
+        # part of the frame inside the window, in frame and in window coordinates
+        top, bottom = max(y, y0), min(y + h, y1)
+        left, right = max(x, x0), min(x + w, x1)
+        src = (slice(top - y, bottom - y), slice(left - x, right - x))
+        dst = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+
+        if blend == 'none':
+            out[dst] = img[src]
+            continue
+        weights = feather_weights(h, w) if blend == 'feather' else np.ones((h, w), np.float32)
+        weights = weights[src].reshape(weight_sum[dst].shape)
+        total[dst] += img[src] * weights
+        weight_sum[dst] += weights
+
+    if blend != 'none':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            blended = np.where(weight_sum > 0, total / weight_sum, 0)
+        out[...] = np.rint(blended).astype(out.dtype)
+
+
+def merge(offsetsfile, imagedir, outputfile, blend='none', strip_size=1024, axis=None,
+          max_workers=4, prefetch=8, max_memory=512):
+    """
+    Composites all images of a chain of translations into a single panorama.
+    The canvas is split into strips that are composited in parallel,
+    each only reading the images intersecting it. All images are assumed
+    to be of the same size, as are the frames of a video.
+    """
+    frames = layout(offsetsfile)
+    first = fs.imread(os.path.join(imagedir, frames[0][0]))
+    h, w = first.shape[:2]
+
+    # move the origin to the top left corner of the canvas
+    min_x = min(x for _, x, _ in frames)
+    min_y = min(y for _, _, y in frames)
+    frames = [(file, x - min_x, y - min_y, h, w) for file, x, y in frames]
+    height = max(y for _, _, y, _, _ in frames) + h
+    width = max(x for _, x, _, _, _ in frames) + w
+    canvas = np.zeros((height, width) + first.shape[2:], dtype=first.dtype)
+
+    # strips cover disjoint parts of the canvas, so they can be written concurrently
+    windows = list(strips(height, width, strip_size, axis=axis))
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        jobs = [ex.submit(composite_strip, canvas, window, frames, imagedir, blend=blend,
+                          prefetch=prefetch, max_memory=max_memory // max_workers)
+                for window in windows]
+        for job in tqdm(futures.as_completed(jobs), total=len(jobs)):
+            job.result()
+
+    cv.imwrite(outputfile, canvas)
     print('Done.', os.path.abspath(outputfile))
 
 
@@ -70,6 +144,23 @@ if __name__ == '__main__':
                         help='Image directory')
     parser.add_argument('output',
                         help='Output file')
+    parser.add_argument('-b', '--blend', choices=['none', 'feather', 'average'], default='none',
+                        help='Paste images over each other, or blend overlapping images weighted by their distance to the image border or uniformly')
+    parser.add_argument('--strip-size', type=int, default=1024,
+                        help='Number of pixels across each strip of the canvas composited in parallel')
+    parser.add_argument('--axis', type=int, choices=[0, 1],
+                        help='Split the canvas into horizontal (0) or vertical (1) strips (default: across its longer side)')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='Maximum number of strips to composite in parallel')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of images to read ahead')
+    parser.add_argument('--max-memory', type=int, default=512,
+                        help='Maximum number of megabytes of images to read ahead')
     args = parser.parse_args()
 
-    merge(args.offsets, args.input, args.output)
+    merge(args.offsets, args.input, args.output,
+          blend=args.blend,
+          strip_size=args.strip_size,
+          axis=args.axis,
+          max_workers=args.max_workers,
+          prefetch=args.prefetch, max_memory=args.max_memory)
@@ -1,58 +1,128 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 
+import json
 import os
+import sys
 import cv2 as cv
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+import pipeline as pl
 
-def pad(imagedir, translations, output, reference):
+
+def reasonable_translations(translations):
     df = pd.read_csv(translations, index_col=0)
     reasonable = df[abs(df['x']) < 800]
     reasonable = reasonable[abs(reasonable['y']) < 800]
+
+    if(len(df.index) > len(reasonable.index)):
+        print(len(df.index), 'files supplied, only',
+              len(reasonable.index), 'have reasonable values (< 800px L∞-translation):')
+        print(reasonable.index)
+
+    return reasonable
+
+
+def paddings(x, y):
+    """
+    Computes the borders (top, bottom, left, right) to add to an image
+    and its reference image that is translated by x, y.
+    """
+    top_file, bottom_file = (0, y) if y > 0 else (-y, 0)
+    left_file, right_file = (0, x) if x > 0 else (-x, 0)
+
+    top_ref, bottom_ref = (y, 0) if y > 0 else (0, -y)
+    left_ref, right_ref = (0, x) if x > 0 else (0, -x)
+
+    return ((top_file, bottom_file, left_file, right_file),
+            (top_ref, bottom_ref, left_ref, right_ref))
+
+
+def pad(imagedir, translations, output, reference, prefetch=8, max_memory=512):
+    reasonable = reasonable_translations(translations)
     files = reasonable.index
     refs = reasonable['ref']
     xs = reasonable['x']
     ys = reasonable['y']
 
-    if(len(df.index) > len(files)):
-        print(len(df.index), 'files supplied, only',
-              len(files), 'have reasonable values (< 800px L∞-translation):')
-        print(files)
+    def read_pair(file):
+        return (fs.imread(os.path.join(imagedir, file)),
+                fs.imread(os.path.join(imagedir, refs[file])))
 
-    for file in tqdm(files):
-        ref = refs[file]
-        x = xs[file]
-        y = ys[file]
+    images = pl.prefetch(files, read=read_pair,
+                         depth=prefetch, max_memory=max_memory)
+    with pl.Writer(depth=prefetch, max_memory=max_memory) as writer:
+        for file, (img, ref_img) in tqdm(images, total=len(files)):
+            ref = refs[file]
+            x = xs[file]
+            y = ys[file]
+
+            out_path_file = os.path.join(output, file)
+            out_path_ref = os.path.join(reference, ref)
 
-        in_path_file = os.path.join(imagedir, file)
-        in_path_ref = os.path.join(imagedir, ref)
+            # print(ref, 'is', x, 'pixels further right and',
+            #       y, 'pixels further down than', file)
 
-        out_path_file = os.path.join(output, file)
-        out_path_ref = os.path.join(reference, ref)
+            border_file, border_ref = paddings(x, y)
 
-        img = cv.imread(in_path_file)
-        ref_img = cv.imread(in_path_ref)
+            out_img = cv.copyMakeBorder(img, *border_file, 0)
+            out_ref = cv.copyMakeBorder(ref_img, *border_ref, 0)
+            writer.write(out_path_file, out_img)
+            writer.write(out_path_ref, out_ref)
 
-        # print(ref, 'is', x, 'pixels further right and',
-        #       y, 'pixels further down than', file)
 
-        top_file, bottom_file = (0, y) if y > 0 else (-y, 0)
-        left_file, right_file = (0, x) if x > 0 else (-x, 0)
+def manifest(imagedir, translations, output):
+    """
+    Instead of writing padded copies of all images, writes a JSON file
+    that describes where to place the original images on a blank canvas
+    to obtain the padded images. Assumes all images share the same size.
+    """
+    reasonable = reasonable_translations(translations)
+    files = reasonable.index
+    refs = reasonable['ref']
+    xs = reasonable['x']
+    ys = reasonable['y']
+
+    if not len(files):
+        print('Nothing to do.')
+        return
 
-        top_ref, bottom_ref = (y, 0) if y > 0 else (0, -y)
-        left_ref, right_ref = (0, x) if x > 0 else (0, -x)
+    # every frame of a video has the same size
+    img = fs.imread(os.path.join(imagedir, files[0]))
+    img_w, img_h = img.shape[1], img.shape[0]
 
-        out_img = cv.copyMakeBorder(img,
-                                    top_file, bottom_file, left_file, right_file,
-                                    0)
-        out_ref = cv.copyMakeBorder(ref_img,
-                                    top_ref, bottom_ref, left_ref, right_ref,
-                                    0)
-        cv.imwrite(out_path_file, out_img)
-        cv.imwrite(out_path_ref, out_ref)
+    entries = []
+    for file in files:
+        ref = refs[file]
+        x = int(xs[file])
+        y = int(ys[file])
+
+        border_file, border_ref = paddings(x, y)
+        top_file, bottom_file, left_file, right_file = border_file
+        top_ref, bottom_ref, left_ref, right_ref = border_ref
+
+        entries.append({
+            'file': file,
+            'ref': ref,
+            'file_x': left_file,
+            'file_y': top_file,
+            'file_width': img_w + left_file + right_file,
+            'file_height': img_h + top_file + bottom_file,
+            'ref_x': left_ref,
+            'ref_y': top_ref,
+            'ref_width': img_w + left_ref + right_ref,
+            'ref_height': img_h + top_ref + bottom_ref,
+        })
+
+    with open(output, 'w') as f:
+        json.dump(entries, f, indent=2)
+    print('Done.', output)
 
 
 if __name__ == '__main__':
@@ -67,13 +137,24 @@ if __name__ == '__main__':
         '-o', '--output', help='Output directory of padded files')
     parser.add_argument('-r', '--reference',
                         help='Output directory of reference images')
+    parser.add_argument('-m', '--manifest',
+                        help='Write offsets to this JSON file instead of padded images')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of images to read ahead and to write behind')
+    parser.add_argument('--max-memory', type=int, default=512,
+                        help='Maximum number of megabytes of images to read ahead and to write behind, respectively')
     args = parser.parse_args()
 
-    if not args.output:
-        args.output = os.path.join(args.input, os.path.pardir, 'padded')
-        os.makedirs(args.output, exist_ok=True)
-    if not args.reference:
-        args.reference = os.path.join(args.input, os.path.pardir, 'reference')
-        os.makedirs(args.reference, exist_ok=True)
-
-    pad(args.input, args.translations, args.output, args.reference)
+    if args.manifest:
+        manifest(args.input, args.translations, args.manifest)
+    else:
+        if not args.output:
+            args.output = os.path.join(args.input, os.path.pardir, 'padded')
+            os.makedirs(args.output, exist_ok=True)
+        if not args.reference:
+            args.reference = os.path.join(
+                args.input, os.path.pardir, 'reference')
+            os.makedirs(args.reference, exist_ok=True)
+
+        pad(args.input, args.translations, args.output, args.reference,
+            prefetch=args.prefetch, max_memory=args.max_memory)
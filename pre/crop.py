@@ -4,20 +4,41 @@
 import cv2 as cv
 import numpy as np
 import os
+import sys
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+import pipeline as pl
+
+
+def crop_image(img, north=0, east=0, south=0, west=0):
+    return img[north:-south-1, west:-east-1]
 
 
 def crop(imagefile, output, north=0, east=0, south=0, west=0):
-    img = cv.imread(imagefile)
-    cropped = img[north:-south-1, west:-east-1]
+    img = fs.imread(imagefile)
+    cropped = crop_image(img, north, east, south, west)
     cv.imwrite(output, cropped)
     print('Cropped', imagefile, 'to',  os.path.abspath(output))
 
 
-def crop_all(imagedir, output, north=0, east=0, south=0, west=0):
-    for file in sorted(os.listdir(imagedir)):
-        imagefile = os.path.join(imagedir, file)
-        outputfile = os.path.join(output, file)
-        crop(imagefile, outputfile, north, east, south, west)
+def crop_all(imagedir, output, north=0, east=0, south=0, west=0, store=False,
+             prefetch=8, max_memory=512):
+    if store:
+        fs.map_store(imagedir, output,
+                     lambda img: crop_image(img, north, east, south, west))
+        print('Cropped', imagedir, 'to frame store', os.path.abspath(output))
+        return
+    files = sorted(fs.listdir(imagedir))
+    images = pl.prefetch([os.path.join(imagedir, file) for file in files],
+                         depth=prefetch, max_memory=max_memory)
+    with pl.Writer(depth=prefetch, max_memory=max_memory) as writer:
+        for file, (imagefile, img) in zip(files, images):
+            outputfile = os.path.join(output, file)
+            writer.write(outputfile, crop_image(img, north, east, south, west))
+            print('Cropped', imagefile, 'to',  os.path.abspath(outputfile))
 
 
 if __name__ == '__main__':
@@ -35,6 +56,12 @@ if __name__ == '__main__':
                         default=0, help='Trim from right')
     parser.add_argument('-w', '--west', type=int,
                         default=0, help='Trim from left')
+    parser.add_argument('--store', action='store_true',
+                        help='Write a frame store instead of image files (regarded iff input is directory)')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of images to read ahead and to write behind (regarded iff input is directory)')
+    parser.add_argument('--max-memory', type=int, default=512,
+                        help='Maximum number of megabytes of images to read ahead and to write behind, respectively (regarded iff input is directory)')
     args = parser.parse_args()
 
     is_dir = os.path.isdir(args.input)
@@ -50,7 +77,8 @@ if __name__ == '__main__':
 
     if is_dir:
         crop_all(args.input, args.output,
-                 north=args.north, south=args.south, west=args.west, east=args.east)
+                 north=args.north, south=args.south, west=args.west, east=args.east,
+                 store=args.store, prefetch=args.prefetch, max_memory=args.max_memory)
     else:
         crop(args.input, args.output,
              north=args.north, south=args.south, west=args.west, east=args.east)
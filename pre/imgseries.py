@@ -2,7 +2,25 @@
 # -*- coding: utf8 -*-
 
 import os
+import sys
+from concurrent import futures
+from fractions import Fraction
+
+import cv2 as cv
 import ffmpeg
+import numpy as np
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+
+# channels and data type of frames per pixel format
+PIXEL_FORMATS = {
+    'bgr24': (3, np.uint8),
+    'gray': (1, np.uint8),
+    'gray16le': (1, np.dtype('<u2')),
+}
 
 
 def imgseries(videofile, output, fps):
@@ -17,6 +35,219 @@ def imgseries(videofile, output, fps):
     print('Done.', output)
 
 
+def read_frames(videofile, fps, pix_fmt='bgr24'):
+    """
+    Decodes the given video at the given fps rate
+    and yields its frames as BGR images
+    (or in any other of the supported pixel formats).
+    """
+    probe = ffmpeg.probe(videofile)
+    video = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    w, h = int(video['width']), int(video['height'])
+    channels, dtype = PIXEL_FORMATS[pix_fmt]
+    shape = (h, w, channels) if channels > 1 else (h, w)
+    size = w * h * channels * np.dtype(dtype).itemsize
+
+    process = (
+        ffmpeg.input(videofile)
+        .filter('fps', fps=fps)
+        .output('pipe:', format='rawvideo', pix_fmt=pix_fmt)
+        .run_async(pipe_stdout=True)
+    )
+    try:
+        while True:
+            buffer = process.stdout.read(size)
+            if len(buffer) < size:
+                break
+            yield np.frombuffer(buffer, dtype).reshape(shape)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def signature(frame, size=32):
+    """
+    Computes a cheap similarity signature of a frame
+    by downscaling its grayscale version.
+    """
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return cv.resize(gray, (size, size), interpolation=cv.INTER_AREA).astype(np.float32)
+
+
+def imgseries_dedup(videofile, output, fps, min_motion=2.0):
+    """
+    Same as `imgseries`, but drops every frame whose mean absolute difference
+    to the last extracted frame (compared by signature) is below `min_motion`
+    gray levels. Extracted frames keep the number they would have had
+    without dropping any frames.
+    """
+
+    print('Extracting distinct frames from', videofile, 'to directory', output)
+    last = None
+    kept, skipped = 0, 0
+    for number, frame in enumerate(read_frames(videofile, fps), start=1):
+        file = 'frame-{:06d}.jpg'.format(number)
+        current = signature(frame)
+        if last is not None:
+            motion = np.abs(current - last).mean()
+            if motion < min_motion:
+                print('Skipping', file, 'with motion', '{:.2f}'.format(motion))
+                skipped += 1
+                continue
+        cv.imwrite(os.path.join(output, file), frame)
+        last = current
+        kept += 1
+    print('Done.', output, '| Kept', kept, 'frames, skipped', skipped)
+
+
+def overlap_of(shift, w, h):
+    """
+    Computes the fraction of overlapping area of two frames
+    of size w, h that are translated by the given shift.
+    """
+    dx, dy = np.abs(shift)
+    return max(0, 1 - dx / w) * max(0, 1 - dy / h)
+
+
+def imgseries_adaptive(videofile, output, fps, overlap=0.5, scale=0.25):
+    """
+    Same as `imgseries`, but treats the frames decoded at the given fps rate
+    as mere candidates. The displacement between consecutive candidates
+    is estimated by phase correlation on downscaled versions of them.
+    A candidate is only extracted if skipping it would make the overlap
+    between the last extracted frame and the next candidate fall below
+    the given fraction. Extracted frames keep their candidate number.
+    """
+
+    print('Extracting frames with', overlap, 'overlap from', videofile,
+          'to directory', output)
+    window = None
+    previous = None  # (number, frame, downscaled frame) of last candidate
+    pending = False  # whether the last candidate has not been extracted
+    shift = np.zeros(2)  # displacement since last extracted frame
+    kept, count = 0, 0
+
+    def write(number, frame):
+        cv.imwrite(os.path.join(output, 'frame-{:06d}.jpg'.format(number)), frame)
+
+    for number, frame in enumerate(read_frames(videofile, fps), start=1):
+        count += 1
+        h, w = frame.shape[:2]
+        small = cv.resize(cv.cvtColor(frame, cv.COLOR_BGR2GRAY), None,
+                          fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        small = small.astype(np.float32)
+
+        if previous is None:
+            write(number, frame)
+            kept += 1
+        else:
+            if window is None:
+                window = cv.createHanningWindow(small.shape[::-1], cv.CV_32F)
+            (dx, dy), _ = cv.phaseCorrelate(previous[2], small, window)
+            step = np.array([dx, dy]) / scale
+
+            if overlap_of(shift + step, w, h) < overlap:
+                if pending:
+                    # last candidate was the last one with enough overlap
+                    write(*previous[:2])
+                    kept += 1
+                    shift = np.zeros(2)
+                    pending = False
+                shift = shift + step
+                if overlap_of(shift, w, h) < overlap:
+                    print('WARNING: overlap of', previous[0], 'and', number,
+                          'is merely', '{:.2f},'.format(overlap_of(shift, w, h)),
+                          'consider increasing the fps rate')
+                    write(number, frame)
+                    kept += 1
+                    shift = np.zeros(2)
+                else:
+                    pending = True
+            else:
+                shift += step
+                pending = True
+
+        previous = (number, frame, small)
+
+    # always cover the end of the video
+    if pending:
+        write(*previous[:2])
+        kept += 1
+    print('Done.', output, '| Kept', kept, 'of', count, 'frames')
+
+
+def imgseries_parallel(videofile, output, fps, segments=4):
+    """
+    Same as `imgseries`, but splits the video into the given number of
+    time segments and extracts their frames in parallel ffmpeg processes.
+    Afterwards, the frames are renamed such that their numbering
+    is continuous across all segments.
+    """
+
+    print('Extracting frames from', videofile, 'to directory', output,
+          'in', segments, 'segments')
+    duration = float(ffmpeg.probe(videofile)['format']['duration'])
+    # segment boundaries are aligned to the fps rate
+    rate = Fraction(fps)
+    ticks = int(duration * rate)
+    bounds = [Fraction(ticks * i // segments) / rate for i in range(segments + 1)]
+    bounds[-1] = duration
+
+    def helper_func(i):
+        segment_dir = os.path.join(output, '.segment-{:03d}'.format(i))
+        os.makedirs(segment_dir, exist_ok=True)
+        start, end = float(bounds[i]), float(bounds[i + 1])
+        (
+            ffmpeg.input(videofile, ss=start, t=end - start)
+            .filter('fps', fps=fps)
+            .output(os.path.join(segment_dir, 'frame-%06d.jpg'))
+            .run(quiet=True)
+        )
+        return segment_dir
+
+    with futures.ThreadPoolExecutor(max_workers=segments) as ex:
+        segment_dirs = list(ex.map(helper_func, range(segments)))
+
+    number = 0
+    for segment_dir in segment_dirs:
+        for file in sorted(os.listdir(segment_dir)):
+            number += 1
+            os.replace(os.path.join(segment_dir, file),
+                       os.path.join(output, 'frame-{:06d}.jpg'.format(number)))
+        os.rmdir(segment_dir)
+    print('Done.', output, '|', number, 'frames')
+
+
+def imgseries_store(videofile, output, fps, pix_fmt='gray16le'):
+    """
+    Same as `imgseries`, but writes all frames to a frame store
+    instead of JPG files. By default, frames are stored as 16 bit grayscale
+    images in order to retain the precision of thermal recordings.
+    """
+
+    print('Extracting frames from', videofile, 'to frame store', output)
+    probe = ffmpeg.probe(videofile)
+    video = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    w, h = int(video['width']), int(video['height'])
+    channels, dtype = PIXEL_FORMATS[pix_fmt]
+    shape = (h, w, channels) if channels > 1 else (h, w)
+
+    # leave some room as the number of frames is only known afterwards
+    capacity = int(float(probe['format']['duration']) * Fraction(fps)) + 2
+    frames = fs.create(output, capacity, shape, dtype)
+
+    files = []
+    for number, frame in enumerate(read_frames(videofile, fps, pix_fmt=pix_fmt), start=1):
+        if number > capacity:
+            print('WARNING: frame store is full, dropping remaining frames')
+            break
+        frames[number - 1] = frame
+        files.append('frame-{:06d}.jpg'.format(number))
+    frames.flush()
+    fs.write_index(output, files)
+    print('Done.', output, '|', len(files), 'frames')
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(
@@ -26,6 +257,14 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', help='Output directory')
     parser.add_argument('--fps', default='1/2',
                         help='Frames extracted per second of video. Use 10 or 1/2 (default) or 0.3 or the like')
+    parser.add_argument('-m', '--min-motion', type=float,
+                        help='Skip frames that differ less than this many gray levels on average from the last extracted frame')
+    parser.add_argument('--overlap', type=float,
+                        help='Sample frames such that consecutive frames overlap by this fraction, using fps as candidate rate')
+    parser.add_argument('--store', choices=list(PIXEL_FORMATS.keys()),
+                        help='Write frames to a frame store of the given pixel format instead of JPG files')
+    parser.add_argument('-s', '--segments', type=int,
+                        help='Decode this many segments of the video in parallel')
 
     args = parser.parse_args()
 
@@ -38,4 +277,17 @@ if __name__ == '__main__':
 
     print(args)
 
-    imgseries(args.videofile, args.output, args.fps)
+    if args.store is not None:
+        imgseries_store(args.videofile, args.output, args.fps,
+                        pix_fmt=args.store)
+    elif args.overlap is not None:
+        imgseries_adaptive(args.videofile, args.output, args.fps,
+                           overlap=args.overlap)
+    elif args.segments is not None:
+        imgseries_parallel(args.videofile, args.output, args.fps,
+                           segments=args.segments)
+    elif args.min_motion is not None:
+        imgseries_dedup(args.videofile, args.output, args.fps,
+                        min_motion=args.min_motion)
+    else:
+        imgseries(args.videofile, args.output, args.fps)
@@ -4,11 +4,18 @@
 import cv2 as cv
 import numpy as np
 import os
+import sys
 from tqdm import tqdm
 
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+import pipeline as pl
+
 
 def scale(imagefile, output, factor, interpolation=cv.INTER_LINEAR, verbose=True):
-    img = cv.imread(imagefile)
+    img = fs.imread(imagefile)
     img = cv.resize(img, None, fx=factor, fy=factor,
                     interpolation=interpolation)
     cv.imwrite(output, img)
@@ -18,12 +25,22 @@ def scale(imagefile, output, factor, interpolation=cv.INTER_LINEAR, verbose=True
               'without change', imagefile, 'to',  os.path.abspath(output))
 
 
-def scale_all(imagedir, output, factor, interpolation=cv.INTER_LINEAR):
-    for file in tqdm(list(sorted(os.listdir(imagedir)))):
-        imagefile = os.path.join(imagedir, file)
-        outputfile = os.path.join(output, file)
-        scale(imagefile, outputfile, factor,
-              interpolation=interpolation, verbose=False)
+def scale_all(imagedir, output, factor, interpolation=cv.INTER_LINEAR, store=False,
+              prefetch=8, max_memory=512):
+    if store:
+        fs.map_store(imagedir, output,
+                     lambda img: cv.resize(img, None, fx=factor, fy=factor,
+                                           interpolation=interpolation))
+        print('Scaled all images from', imagedir, 'to frame store', output, 'by', factor)
+        return
+    files = list(sorted(fs.listdir(imagedir)))
+    images = pl.prefetch([os.path.join(imagedir, file) for file in files],
+                         depth=prefetch, max_memory=max_memory)
+    with pl.Writer(depth=prefetch, max_memory=max_memory) as writer:
+        for file, (_, img) in tqdm(zip(files, images), total=len(files)):
+            img = cv.resize(img, None, fx=factor, fy=factor,
+                            interpolation=interpolation)
+            writer.write(os.path.join(output, file), img)
     print('Scaled all images from', imagedir, 'to', output, 'by', factor)
 
 
@@ -41,6 +58,12 @@ if __name__ == '__main__':
                         const=cv.INTER_CUBIC, help='Use cubic interpolation (cv.INTER_CUBIC)')
     parser.add_argument('-l', '--linear', dest='interpolation', action='store_const',
                         const=cv.INTER_LINEAR, help='Use linear interpolation (cv.INTER_LINEAR)')
+    parser.add_argument('--store', action='store_true',
+                        help='Write a frame store instead of image files (regarded iff input is directory)')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of images to read ahead and to write behind (regarded iff input is directory)')
+    parser.add_argument('--max-memory', type=int, default=512,
+                        help='Maximum number of megabytes of images to read ahead and to write behind, respectively (regarded iff input is directory)')
     args = parser.parse_args()
 
     is_dir = os.path.isdir(args.input)
@@ -59,7 +82,8 @@ if __name__ == '__main__':
 
     if is_dir:
         scale_all(args.input, args.output, args.factor,
-                  interpolation=args.interpolation)
+                  interpolation=args.interpolation, store=args.store,
+                  prefetch=args.prefetch, max_memory=args.max_memory)
     else:
         scale(args.input, args.output, args.factor,
               interpolation=args.interpolation)
@@ -5,6 +5,40 @@ import ffmpeg
 import os
 
 
+# Codecs that only consist of key frames can be cut at any frame without re-encoding
+INTRA_ONLY_CODECS = {'mjpeg', 'rawvideo', 'huffyuv', 'ffvhuff', 'ffv1',
+                     'prores', 'dnxhd', 'png', 'tiff', 'jpeg2000', 'utvideo'}
+
+
+def can_copy(videofile, start, end):
+    """
+    Returns true if the video can be trimmed at the given points
+    by copying its streams, which is the case if every frame is a key frame.
+    Without any cut points, the video is converted and never copied.
+    """
+    if not start and not end:
+        return False
+    probe = ffmpeg.probe(videofile)
+    video = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    return video['codec_name'] in INTRA_ONLY_CODECS
+
+
+def trim_copy(videofile, output, start, end):
+
+    print('Processing', videofile, ', copying streams to file', output)
+    options = {}
+    if start:
+        options['ss'] = start
+    if end:
+        options['to'] = end
+    (
+        ffmpeg.input(videofile, **options)
+        .output(output, c='copy')
+        .run()
+    )
+    print('Done.', output)
+
+
 def trim(videofile, output, start, end):
 
     print('Processing', videofile, ', creating file', output)
@@ -45,6 +79,8 @@ if __name__ == '__main__':
                         help='Start of trimmed video in seconds')
     parser.add_argument('-e', '--end', type=int,
                         help='End of trimmed video in seconds')
+    parser.add_argument('-r', '--reencode', action='store_true',
+                        help='Always re-encode, even if the streams could be copied')
 
     args = parser.parse_args()
 
@@ -55,4 +91,7 @@ if __name__ == '__main__':
 
     print(args)
 
-    trim(args.videofile, args.output, args.start, args.end)
+    if not args.reencode and can_copy(args.videofile, args.start, args.end):
+        trim_copy(args.videofile, args.output, args.start, args.end)
+    else:
+        trim(args.videofile, args.output, args.start, args.end)
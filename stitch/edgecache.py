@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# An edge cache stores the edge maps that Hough transforms vote on, so that
+# repeated experiments with Hough thresholds and strategies do not decode and
+# edge-detect the very same frames over and over again. All edge maps live in
+# a single zip file of bit-packed NumPy arrays (just like those of `np.savez`),
+# named after a hash of the frame's content, the parameters of the edge
+# detection and the shape of the edge map.
+
+import hashlib
+import os
+import threading
+import zipfile
+
+import cv2 as cv
+import numpy as np
+
+import framestore as fs
+
+
+def frame_hash(imagefile):
+    """
+    Returns a hash of the content of an image file or a frame of a frame store.
+    """
+    directory, file = os.path.split(imagefile)
+    if fs.is_store(directory):
+        data = fs.imread(imagefile, cv.IMREAD_UNCHANGED).tobytes()
+    else:
+        with open(imagefile, 'rb') as f:
+            data = f.read()
+    return hashlib.sha1(data).hexdigest()
+
+
+class EdgeCache:
+    """
+    `EdgeCache`s map keys, as returned by `key`, to edge maps.
+    New edge maps are kept in memory and appended to the cache file once
+    `max_pending` of them were added. Use as a context manager to make sure
+    all of them are written at the end. Safe to use from multiple threads.
+    """
+
+    def __init__(self, path, max_pending=100):
+        self.path = path
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.members = {}
+        self.zipfile = None
+        if os.path.isfile(path):
+            try:
+                self.zipfile = zipfile.ZipFile(path)
+            except zipfile.BadZipFile:
+                # e.g. if an earlier run was killed while appending to it
+                print('WARNING: Discarding broken edge cache', path)
+                os.remove(path)
+        if self.zipfile is not None:
+            for name in self.zipfile.namelist():
+                key, shape = os.path.splitext(name)[0].rsplit('/', 1)
+                self.members[key] = (name, tuple(map(int, shape.split('x'))))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.members) + len(self.pending)
+
+    @staticmethod
+    def key(imagefile, *params):
+        return '_'.join([frame_hash(imagefile)] + [str(p) for p in params])
+
+    def get(self, key):
+        """
+        Returns the edge map stored under the given key, or None.
+        """
+        with self.lock:
+            if key in self.pending:
+                packed, shape = self.pending[key]
+            elif key in self.members:
+                name, shape = self.members[key]
+                with self.zipfile.open(name) as f:
+                    packed = np.lib.format.read_array(f, allow_pickle=False)
+            else:
+                return None
+        edges = np.unpackbits(packed, axis=1, count=shape[1])
+        return edges * np.uint8(255)
+
+    def put(self, key, edges):
+        """
+        Stores an edge map (any non-zero pixel is an edge) under the given key.
+        """
+        packed = np.packbits(edges > 0, axis=1)
+        with self.lock:
+            self.pending[key] = (packed, edges.shape)
+            if len(self.pending) >= self.max_pending:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        if self.zipfile is not None:
+            self.zipfile.close()
+
+        # appending only rewrites the directory at the end of the zip file, not the edge maps
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+            for key, (packed, shape) in self.pending.items():
+                if key in self.members:
+                    continue
+                name = key + '/' + 'x'.join(map(str, shape)) + '.npy'
+                with zf.open(name, 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, packed, allow_pickle=False)
+                self.members[key] = (name, shape)
+
+        self.pending = {}
+        self.zipfile = zipfile.ZipFile(self.path)
+
+    def flush(self):
+        """
+        Appends all new edge maps to the cache file.
+        """
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.zipfile is not None:
+                self.zipfile.close()
+                self.zipfile = None
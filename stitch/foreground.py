@@ -9,53 +9,56 @@ import pandas as pd
 from tqdm import tqdm
 
 import lineutils as ut
+import pipeline as pl
 from lineutils import r, t, x, y
 
 
-def foreground(hough, inputdir, outputdir, color=(0, 0, 0)):
+def foreground(hough, inputdir, outputdir, color=(0, 0, 0), prefetch=8, max_memory=512):
     df = pd.read_csv(hough, index_col=0)
     lines_per_file = {file: list(zip(group_df['rho'], group_df['theta']))
                       for file, group_df in df.groupby(by='file')}
 
-    for file in tqdm(list(sorted(lines_per_file.keys()))):
-        img_path = os.path.join(inputdir, file)
-        out_path = os.path.join(outputdir, file)
-        lines = [ut.normalize(l) for l in lines_per_file[file]]
+    files = list(sorted(lines_per_file.keys()))
+    images = pl.prefetch([os.path.join(inputdir, file) for file in files],
+                         depth=prefetch, max_memory=max_memory)
+    with pl.Writer(depth=prefetch, max_memory=max_memory) as writer:
+        for file, (_, img) in tqdm(zip(files, images), total=len(files)):
+            out_path = os.path.join(outputdir, file)
+            lines = [ut.normalize(l) for l in lines_per_file[file]]
 
-        # average rho value used to determine left/right sides of lines
-        average_rho = (np.array([r(l) for l in lines])
-                       .mean(0)
-                       .astype(int))
+            # average rho value used to determine left/right sides of lines
+            average_rho = (np.array([r(l) for l in lines])
+                           .mean(0)
+                           .astype(int))
 
-        img = cv.imread(img_path)
-        img_w, img_h = img.shape[1], img.shape[0]
+            img_w, img_h = img.shape[1], img.shape[0]
 
-        # used for cutting off left side
-        left_side = [(0, img_h), (0, 0)]
-        # used for cutting off right side
-        right_side = [(img_w, img_h), (img_w, 0)]
+            # used for cutting off left side
+            left_side = [(0, img_h), (0, 0)]
+            # used for cutting off right side
+            right_side = [(img_w, img_h), (img_w, 0)]
 
-        for line in lines:
-            rho, theta = line
+            for line in lines:
+                rho, theta = line
 
-            cos_theta = np.cos(theta)
-            if not cos_theta:  # line is exactly horizontal
-                continue  # should not happen, but prevents both /0
+                cos_theta = np.cos(theta)
+                if not cos_theta:  # line is exactly horizontal
+                    continue  # should not happen, but prevents both /0
 
-            # x axis intersection
-            top = (rho / cos_theta, 0)
+                # x axis intersection
+                top = (rho / cos_theta, 0)
 
-            rho_bottom, theta_bottom = ut.move_origin(line, y=img_h)
-            # line's intersection point with image's bottom border
-            bottom = (rho_bottom / np.cos(theta_bottom), img_h)
+                rho_bottom, theta_bottom = ut.move_origin(line, y=img_h)
+                # line's intersection point with image's bottom border
+                bottom = (rho_bottom / np.cos(theta_bottom), img_h)
 
-            # polygon around left/right side of background
-            polygon = np.array([top, bottom,
-                                *(left_side if rho < average_rho else right_side)], dtype=int)
+                # polygon around left/right side of background
+                polygon = np.array([top, bottom,
+                                    *(left_side if rho < average_rho else right_side)], dtype=int)
 
-            cv.fillConvexPoly(img, polygon, color)
+                cv.fillConvexPoly(img, polygon, color)
 
-        cv.imwrite(out_path, img)
+            writer.write(out_path, img)
 
 
 if __name__ == '__main__':
@@ -75,6 +78,10 @@ if __name__ == '__main__':
                         help='Replace background with this green value')
     parser.add_argument('-b', '--blue', type=int, default=0,
                         help='Replace background with this blue value')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of images to read ahead and to write behind')
+    parser.add_argument('--max-memory', type=int, default=512,
+                        help='Maximum number of megabytes of images to read ahead and to write behind, respectively')
 
     args = parser.parse_args()
 
@@ -90,4 +97,5 @@ if __name__ == '__main__':
         args.output = os.path.join(args.input, '_foreground')
         os.makedirs(args.output)
     foreground(args.hough, args.input, args.output,
-               color=(args.blue, args.green, args.red))
+               color=(args.blue, args.green, args.red),
+               prefetch=args.prefetch, max_memory=args.max_memory)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# A frame store is a directory holding all frames of a video
+# in a single memory-mapped array `frames.npy` of shape (N, H, W) or (N, H, W, C)
+# as well as their file names in `index.csv`. Frames can be of higher precision
+# than JPG files (e.g. 16 bit thermal data), do not need to be decoded,
+# and are shared among threads and processes via the page cache.
+
+# Scripts accept a frame store wherever they accept a directory of images.
+# Paths of frames inside a frame store are built by joining the frame store
+# directory and a file name, just like paths of regular image files.
+
+import functools
+import os
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+
+def is_store(path):
+    """
+    Returns true if the given path is a frame store.
+    """
+    return os.path.isfile(os.path.join(path, 'frames.npy'))
+
+
+def create(path, count, shape, dtype=np.uint8):
+    """
+    Creates a new frame store with room for `count` frames of the given shape
+    and returns the writable array of frames. Make sure to call `write_index`
+    once all frames were written.
+    """
+    os.makedirs(path, exist_ok=True)
+    open_store.cache_clear()
+    return np.lib.format.open_memmap(os.path.join(path, 'frames.npy'), mode='w+',
+                                     dtype=dtype, shape=(count, *shape))
+
+
+def write_index(path, files):
+    """
+    Stores the file names of the frames of a frame store in order.
+    """
+    pd.DataFrame({'file': files}).to_csv(os.path.join(path, 'index.csv'),
+                                         index=False)
+
+
+@functools.lru_cache()
+def open_store(path):
+    return FrameStore(path)
+
+
+class FrameStore:
+    """
+    `FrameStore`s provide random access to the frames of a frame store
+    by index as well as by file name.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = list(pd.read_csv(os.path.join(path, 'index.csv'))['file'])
+        self.index = {file: i for i, file in enumerate(self.files)}
+        self.frames = np.load(os.path.join(path, 'frames.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def read(self, file, flags=cv.IMREAD_COLOR):
+        """
+        Reads a frame by file name the same way `cv.imread` would read the
+        corresponding image file, i.e. as 8 bit BGR or grayscale image
+        depending on `flags`. `cv.IMREAD_UNCHANGED` returns a read-only view
+        on the frame in its original precision without copying it.
+        """
+        frame = self.frames[self.index[file]]
+        if flags == cv.IMREAD_UNCHANGED:
+            return frame
+        if frame.dtype == np.uint16:
+            frame = (frame >> 8).astype(np.uint8)
+        elif frame.dtype != np.uint8:
+            frame = cv.convertScaleAbs(frame)
+        color = frame.ndim == 3
+        if flags == cv.IMREAD_GRAYSCALE:
+            return cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if color else np.array(frame)
+        return np.array(frame) if color else cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+
+
+def imread(path, flags=cv.IMREAD_COLOR):
+    """
+    Drop-in replacement for `cv.imread` that also reads frames of frame stores.
+    """
+    directory, file = os.path.split(path)
+    if is_store(directory):
+        return open_store(os.path.abspath(directory)).read(file, flags)
+    return cv.imread(path, flags)
+
+
+def listdir(path):
+    """
+    Drop-in replacement for `os.listdir` that lists the frames of frame stores.
+    """
+    if is_store(path):
+        return list(open_store(os.path.abspath(path)).files)
+    return os.listdir(path)
+
+
+def list_images(path):
+    """
+    Like `listdir`, but leaves out files of a directory that are not images.
+    """
+    if is_store(path):
+        return listdir(path)
+    return [file for file in os.listdir(path)
+            if file.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def map_store(imagedir, output, func):
+    """
+    Applies `func` to all frames (or images) in `imagedir` in their original
+    precision and writes the results to a new frame store at `output`.
+    """
+    files = sorted(listdir(imagedir))
+    frames = None
+    for i, file in enumerate(files):
+        frame = func(imread(os.path.join(imagedir, file), cv.IMREAD_UNCHANGED))
+        if frames is None:
+            frames = create(output, len(files), frame.shape, frame.dtype)
+        frames[i] = frame
+    if frames is not None:
+        frames.flush()
+    write_index(output, files)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 
+import contextlib
+import csv
 import os
 from concurrent import futures
 
@@ -10,6 +12,8 @@ import pandas as pd
 
 from tqdm import tqdm
 
+import framestore as fs
+from edgecache import EdgeCache
 import lineutils as ut
 from lineutils import r, t
 
@@ -40,56 +44,127 @@ def naiveFilter(line, max_deviation):
             or abs(np.pi + theta) < max_deviation)
 
 
-def findCenters(lines):
-
-    # Groups of similar lines. Check similarity with dict keys. Dict values are lists of similar lines.
-    groups = {}
+def groupLines(lines):
+    """
+    Groups similar lines, checking similarity with the first line of each group.
+    Returns the groups as well as (line, first lines of similar groups)
+    for every line that was similar to more than one group.
+    """
+    groups = []
+    ambiguous = []
 
     for line in lines:
-        similar_lines = list(filter(
-            lambda other: ut.are_lines_similar(line, other),
-            groups.keys()
-        ))
-        count = len(similar_lines)
+        similar_groups = [group for group in groups
+                          if ut.are_lines_similar(line, group[0])]
+        count = len(similar_groups)
         if count == 0:  # no similar lines found, open up new group
-            groups[line] = [line]
+            groups.append([line])
         else:  # similar line found, add this to its group
-            groups[similar_lines[0]].append(line)
+            similar_groups[0].append(line)
             if count > 1:  # multiple similar lines found!
-                print('Found multiple lines similar to', ut.eq(line), 'of which the first will be used:',
-                      *[ut.eq(x) for x in similar_lines])
+                ambiguous.append((line, [group[0] for group in similar_groups]))
 
-    return [np.array(group).mean(0) for group in groups.values()]
+    return groups, ambiguous
 
 
-def hough(imagefile, outputfile=None,
-          threshold=80,
-          normalize=True,
-          filterPredicate=None,
-          center=True,
-          nubPredicate=None,
-          verbose=False):
+def findCenters(lines):
 
-    # Read image file
-    img = cv.imread(imagefile)
-    # Turn into grayscale
+    groups, ambiguous = groupLines(lines)
+    for line, firsts in ambiguous:
+        print('Found multiple lines similar to', ut.eq(line), 'of which the first will be used:',
+              *[ut.eq(first) for first in firsts])
+
+    return [np.array(group).mean(0) for group in groups]
+
+
+def detect_edges(img, low_threshold=50, high_threshold=150, aperture_size=3):
+    """
+    Turns an image into grayscale and detects edges
+    using canny edge detection.
+    """
     gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-    # Detect edges using canny edge detection
-    edges = cv.Canny(gray, 50, 150, apertureSize=3)
-    # Hough transform
-    lines = cv.HoughLines(edges, 1, np.pi/180/100, threshold)
+    return cv.Canny(gray, low_threshold, high_threshold, apertureSize=aperture_size)
+
+
+def load_edges(imagefile, low_threshold=50, high_threshold=150, aperture_size=3,
+               edge_cache=None):
+    """
+    Returns the edges of an image file as detected by `detect_edges`,
+    taking them from an `EdgeCache` if given and possible.
+    """
+    if edge_cache is not None:
+        key = edge_cache.key(imagefile, low_threshold, high_threshold, aperture_size)
+        edges = edge_cache.get(key)
+        if edges is not None:
+            return edges
+
+    edges = detect_edges(fs.imread(imagefile), low_threshold, high_threshold, aperture_size)
+    if edge_cache is not None:
+        edge_cache.put(key, edges)
+    return edges
+
+
+def track_lines(edges, predicted, threshold,
+                rho_window=30, theta_window=0.05):
+    """
+    Searches for lines in narrow windows around the given predicted lines
+    instead of the whole parameter space. For every prediction, only the
+    image columns the line crosses (plus `rho_window` pixels on either side)
+    are voted on, and only angles within `theta_window` of the prediction
+    are considered. Returns raw lines in the coordinate system of the image.
+    """
+    img_h, img_w = edges.shape[:2]
+    res = []
+    for line in predicted:
+        rho, theta = ut.normalize(line)
+
+        # columns crossed by the predicted line at the top and bottom border
+        cos_theta = np.cos(theta)
+        if abs(cos_theta) < 1e-3:  # (almost) horizontal, use full width
+            x_min, x_max = 0, img_w
+        else:
+            x_top = ut.root((rho, theta))
+            x_bottom = ut.root(ut.move_origin((rho, theta), y=img_h))
+            x_min = int(max(0, min(x_top, x_bottom) - rho_window))
+            x_max = int(min(img_w, max(x_top, x_bottom) + rho_window + 1))
+        if x_max - x_min < 2:
+            continue
+        roi = edges[:, x_min:x_max]
+
+        # OpenCV only reports angles in [0, pi) along with a signed rho,
+        # so split up windows that wrap around either end of that interval
+        theta_hough = theta + np.pi if theta < 0 else theta
+        lo, hi = theta_hough - theta_window, theta_hough + theta_window
+        ranges = [(max(lo, 0), min(hi, np.pi))]
+        if lo < 0:
+            ranges.append((np.pi + lo, np.pi))
+        if hi > np.pi:
+            ranges.append((0, hi - np.pi))
+
+        for min_theta, max_theta in ranges:
+            lines = cv.HoughLines(roi, 1, np.pi/180/100, threshold,
+                                  None, 0, 0, min_theta, max_theta)
+            if lines is None:
+                continue
+            for [l] in lines:
+                # move origin back from the ROI to the image
+                l = ut.move_origin(l, x=-x_min, norm=False)
+                if ut.are_lines_similar(ut.normalize(l), (rho, theta),
+                                        max_rho=rho_window,
+                                        max_theta=theta_window):
+                    res.append(l)
+    return res
 
-    if lines is None:
-        lines = []
-        if verbose:
-            print('No lines detected by Hough transform in', imagefile, ' :(')
 
-    # Unpack lists of single elements
-    lines = [l for [l] in lines]
+def process_lines(lines,
+                  normalize=True,
+                  filterPredicate=None,
+                  center=True,
+                  nubPredicate=None):
 
     # Normalize
     if normalize:
-        lines = [ut.normalize(l) for l in lines]
+        lines = list(ut.LineSet.from_lines(lines))
 
     # Filter
     if filterPredicate is not None:
@@ -101,6 +176,62 @@ def hough(imagefile, outputfile=None,
     elif nubPredicate is not None:
         lines = nubBy(nubPredicate, lines)
 
+    return lines
+
+
+def hough(imagefile, outputfile=None,
+          threshold=80,
+          normalize=True,
+          filterPredicate=None,
+          center=True,
+          nubPredicate=None,
+          predicted=None,
+          rho_window=30,
+          theta_window=0.05,
+          canny_low=50,
+          canny_high=150,
+          edge_cache=None,
+          verbose=False):
+
+    # Read image file and detect edges (unless cached)
+    edges = load_edges(imagefile, canny_low, canny_high, edge_cache=edge_cache)
+
+    lines = None
+
+    # Local Hough transform around predicted lines
+    if predicted:
+        lines = process_lines(track_lines(edges, predicted, threshold,
+                                          rho_window=rho_window,
+                                          theta_window=theta_window),
+                              normalize=normalize,
+                              filterPredicate=filterPredicate,
+                              center=center,
+                              nubPredicate=nubPredicate)
+        if len(lines) < len(predicted):
+            # Confidence dropped, some lines got lost
+            if verbose:
+                print('Lost track of', len(predicted) - len(lines), 'line(s) in',
+                      imagefile, ', falling back to full Hough transform')
+            lines = None
+
+    # Full Hough transform
+    if lines is None:
+        lines = cv.HoughLines(edges, 1, np.pi/180/100, threshold)
+
+        if lines is None:
+            lines = []
+            if verbose:
+                print('No lines detected by Hough transform in', imagefile, ' :(')
+
+        # Unpack lists of single elements
+        lines = [l for [l] in lines]
+
+        lines = process_lines(lines,
+                              normalize=normalize,
+                              filterPredicate=filterPredicate,
+                              center=center,
+                              nubPredicate=nubPredicate)
+
     # Log
     if verbose:
         for line in lines:
@@ -108,21 +239,125 @@ def hough(imagefile, outputfile=None,
 
     # Paint
     if outputfile is not None:
-        for line in lines:
-            rho, theta = line
-            a = np.cos(theta)
-            b = np.sin(theta)
-            x0 = a * rho
-            y0 = b * rho
-            x1 = int(x0 + 10000 * (-b))
-            y1 = int(y0 + 10000 * (a))
-            x2 = int(x0 - 10000 * (-b))
-            y2 = int(y0 - 10000 * (a))
+        paint(fs.imread(imagefile), lines, outputfile)
 
-            cv.line(img, (x1, y1), (x2, y2), (0, 0, 255), 2)
+    line_count = len(lines)
+    if line_count < 2:
+        print('WARNING: number of lines is merely',
+              line_count, 'in image file', imagefile)
 
-        # Write copy of image to separate file for visualization
-        cv.imwrite(outputfile, img)
+    if verbose:
+        print('Applied Hough transform on', imagefile,
+              'to ' + outputfile if outputfile is not None else '')
+    return lines
+
+
+def paint(img, lines, outputfile):
+    """
+    Draws the given lines onto the image
+    and writes it to the given file for visualization.
+    """
+    for line in lines:
+        rho, theta = line
+        a = np.cos(theta)
+        b = np.sin(theta)
+        x0 = a * rho
+        y0 = b * rho
+        x1 = int(x0 + 10000 * (-b))
+        y1 = int(y0 + 10000 * (a))
+        x2 = int(x0 - 10000 * (-b))
+        y2 = int(y0 - 10000 * (a))
+
+        cv.line(img, (x1, y1), (x2, y2), (0, 0, 255), 2)
+
+    cv.imwrite(outputfile, img)
+
+
+def fit_line(xs, ys, iterations=100, max_error=2.0, seed=0):
+    """
+    Robustly fits a line `x = a * y + b` through the given points
+    using RANSAC, followed by a least-squares fit over all inliers.
+    Returns the line in polar coordinates, or `None`
+    if there are fewer than two points.
+    """
+    count = len(xs)
+    if count < 2:
+        return None
+
+    # sample all candidate lines at once
+    rng = np.random.default_rng(seed)
+    i, j = rng.integers(0, count, (2, iterations))
+    dy = ys[j] - ys[i]
+    valid = dy != 0
+    if valid.any():
+        i, j, dy = i[valid], j[valid], dy[valid]
+        a = (xs[j] - xs[i]) / dy
+        b = xs[i] - a * ys[i]
+        # count inliers of every candidate line
+        residuals = np.abs(xs[None, :] - (a[:, None] * ys[None, :] + b[:, None]))
+        inliers = residuals[np.argmax((residuals < max_error).sum(1))] < max_error
+    else:
+        inliers = np.ones(count, dtype=bool)
+
+    if inliers.sum() < 2:
+        return None
+
+    # least-squares refinement on inliers
+    a, b = np.polyfit(ys[inliers], xs[inliers], 1)
+
+    # x = a * y + b  <=>  x * cos(theta) + y * sin(theta) = rho
+    norm = np.sqrt(1 + a * a)
+    return ut.normalize((b / norm, np.arctan2(-a, 1)))
+
+
+def rowedges(imagefile, outputfile=None,
+             min_gradient=20,
+             filterPredicate=None,
+             iterations=100,
+             max_error=2.0,
+             verbose=False):
+    """
+    Fast alternative to `hough` for images showing a blade bounded by two
+    near-vertical edges. Finds the strongest rising and falling horizontal
+    gradient in every row and fits the left and right edge line through
+    them. Returns at most two lines just like `hough`.
+    """
+
+    # Read image file
+    img = fs.imread(imagefile)
+    # Turn into grayscale and suppress noise
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    gray = cv.GaussianBlur(gray, (5, 5), 0)
+    # Horizontal gradient of all rows
+    grad = np.diff(gray.astype(np.int16), axis=1)
+
+    # Strongest transitions per row, regardless of whether
+    # the blade is brighter or darker than the background
+    rows = np.arange(grad.shape[0])
+    rising = grad.argmax(1)
+    falling = grad.argmin(1)
+    strong = ((grad[rows, rising] >= min_gradient)
+              & (-grad[rows, falling] >= min_gradient))
+    left = np.minimum(rising, falling)[strong] + 0.5
+    right = np.maximum(rising, falling)[strong] + 0.5
+    ys = rows[strong].astype(float)
+
+    lines = [fit_line(xs, ys, iterations=iterations, max_error=max_error)
+             for xs in (left, right)]
+    lines = [l for l in lines if l is not None]
+
+    # Filter
+    if filterPredicate is not None:
+        lines = list(filter(filterPredicate, lines))
+
+    # Log
+    if verbose:
+        for line in lines:
+            print(ut.eq(line))
+
+    # Paint
+    if outputfile is not None:
+        paint(img, lines, outputfile)
 
     line_count = len(lines)
     if line_count < 2:
@@ -130,11 +365,57 @@ def hough(imagefile, outputfile=None,
               line_count, 'in image file', imagefile)
 
     if verbose:
-        print('Applied Hough transform on', imagefile,
+        print('Fitted edge lines on', imagefile,
               'to ' + outputfile if outputfile is not None else '')
     return lines
 
 
+def append_rows(outputfile, rows, header=False):
+    """
+    Appends rows of lines (file, rho, theta) to a CSV file.
+    Writing the header creates a new file.
+    """
+    df = pd.DataFrame(sorted(rows), columns=['file', 'rho', 'theta'])
+    df.to_csv(outputfile, mode='w' if header else 'a', header=header, index=False)
+
+
+def progress_file(outputfile):
+    return outputfile + '.progress'
+
+
+def record_rows(outputfile, file, rows):
+    """
+    Appends the rows of a file to a CSV file and records the file as completed.
+    """
+    append_rows(outputfile, rows)
+    with open(progress_file(outputfile), 'a') as f:
+        f.write(file + '\n')
+
+
+def restore_progress(outputfile):
+    """
+    Reads the names of the files that were completely processed by an earlier
+    run writing to the given CSV file, and removes rows of any other file
+    (which may have been written partially) from it.
+    Returns the names of the completed files as well as their rows.
+    """
+    if not os.path.isfile(progress_file(outputfile)) or not os.path.isfile(outputfile):
+        return set(), []
+    with open(progress_file(outputfile)) as f:
+        done = set(line.strip() for line in f if line.strip())
+
+    # keep the text of completed rows as is
+    with open(outputfile) as f:
+        header, *lines = f.readlines()
+    lines = [line for line in lines
+             if line.endswith('\n') and next(csv.reader([line]))[0] in done]
+    with open(outputfile, 'w') as f:
+        f.writelines([header] + lines)
+
+    df = pd.read_csv(outputfile)
+    return done, [list(row) for row in df.itertuples(index=False)]
+
+
 def hough_all(imagedir, outputfile,
               paint_output=None,
               threshold=80,
@@ -142,21 +423,43 @@ def hough_all(imagedir, outputfile,
               center=True,
               nubPredicate=None,
               verbose=False,
-              max_workers=4):
-
-    def helper_func(file):
+              max_workers=4,
+              track=False,
+              translations=None,
+              rho_window=30,
+              theta_window=0.05,
+              fit_rows=False,
+              min_gradient=20,
+              canny_low=50,
+              canny_high=150,
+              edge_cache=None,
+              resume=False):
+
+    def helper_func(file, predicted=None):
         rows = []
         imagefile = os.path.join(imagedir, file)
         paint_outputfile = None
         if paint_output is not None:
             paint_outputfile = os.path.join(paint_output, file)
 
-        lines = hough(imagefile, outputfile=paint_outputfile,
-                      threshold=threshold,
-                      filterPredicate=filterPredicate,
-                      center=center,
-                      nubPredicate=nubPredicate,
-                      verbose=verbose)
+        if fit_rows:
+            lines = rowedges(imagefile, outputfile=paint_outputfile,
+                             min_gradient=min_gradient,
+                             filterPredicate=filterPredicate,
+                             verbose=verbose)
+        else:
+            lines = hough(imagefile, outputfile=paint_outputfile,
+                          threshold=threshold,
+                          filterPredicate=filterPredicate,
+                          center=center,
+                          nubPredicate=nubPredicate,
+                          predicted=predicted,
+                          rho_window=rho_window,
+                          theta_window=theta_window,
+                          canny_low=canny_low,
+                          canny_high=canny_high,
+                          edge_cache=edge_cache,
+                          verbose=verbose)
 
         if lines is not None:
             for line in lines:
@@ -164,15 +467,56 @@ def hough_all(imagedir, outputfile,
 
         return rows
 
-    files = sorted(os.listdir(imagedir))
-    res = []
-
-    with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
-        for rows in tqdm(ex.map(helper_func, files), total=len(files)):
-            res += rows
+    files = sorted(fs.listdir(imagedir))
 
-    df = pd.DataFrame(sorted(res), columns=['file', 'rho', 'theta'])
-    df.to_csv(outputfile, index=False)
+    # Rows are appended in order as soon as a file is done,
+    # so that other scripts can already consume them.
+    # The names of completed files are recorded in a separate file
+    # in order to be able to resume an interrupted run.
+    done, previous_rows = restore_progress(outputfile) if resume else (set(), [])
+    if done:
+        print('Resuming after', len(done), 'completed file(s)')
+    else:
+        append_rows(outputfile, [], header=True)
+        open(progress_file(outputfile), 'w').close()
+    remaining = [file for file in files if file not in done]
+
+    if track and not fit_rows:
+        # Translations of a previous stitching run, if any
+        shifts = {}
+        if translations is not None:
+            df = pd.read_csv(translations, index_col=0)
+            shifts = {file: (x, y) for file, x, y
+                      in zip(df.index, df['x'], df['y'])}
+
+        # Frames depend on their predecessors, so process them in order
+        predicted = None
+        shift = (0, 0)
+        for prev, file in tqdm(zip([None] + files, files), total=len(files)):
+            if file in done:
+                # continue tracking where the earlier run stopped
+                if predicted is not None:
+                    shift = shifts.get(prev, shift)
+                rows = [row for row in previous_rows if row[0] == file]
+                predicted = ([(rho, theta) for _, rho, theta in rows]
+                             if len(rows) >= 2 else None)
+                continue
+            if predicted is not None:
+                shift = shifts.get(prev, shift)
+                tx, ty = shift
+                # Lines of the previous frame as seen from this frame
+                predicted = [ut.move_origin(line, x=tx, y=ty)
+                             for line in predicted]
+            rows = helper_func(file, predicted=predicted)
+            record_rows(outputfile, file, rows)
+            # Tracking two lines or more, otherwise search globally next time
+            predicted = ([(rho, theta) for _, rho, theta in rows]
+                         if len(rows) >= 2 else None)
+    else:
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for file, rows in tqdm(zip(remaining, ex.map(helper_func, remaining)),
+                                   total=len(remaining)):
+                record_rows(outputfile, file, rows)
 
 
 if __name__ == '__main__':
@@ -186,35 +530,48 @@ if __name__ == '__main__':
                         help='Output file or directory to draw lines')
     parser.add_argument('-o', '--output',
                         help='Aggregate translations to output csv if input is directory')
-    parser.add_argument('-s', '--strategy', default='center', choices=['center', 'nub', 'none'],
-                        help='Use center of lines close to each other or filter out similar lines')
+    parser.add_argument('-s', '--strategy', default='center', choices=['center', 'nub', 'none', 'rows'],
+                        help='Use center of lines close to each other or filter out similar lines, or fit blade edges per row instead of Hough')
     parser.add_argument('-t', '--threshold', type=int, default=80,
                         help='Threshold to use for Hough transformation')
+    parser.add_argument('-g', '--min-gradient', type=int, default=20,
+                        help='Minimum horizontal gradient of blade edges (regarded iff strategy=rows)')
     parser.add_argument('-d', '--max-v-deviation', type=float,
                         help='Filter lines by their maximum deviation from the vertical line (recommendation: 0.3)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print verbose line equations')
     parser.add_argument('--max-workers', type=int, default=4,
                         help='Maximum number of threads to use')
+    parser.add_argument('--track', action='store_true',
+                        help='Search for lines around those of the previous image (regarded iff input is directory, not available for strategy=rows)')
+    parser.add_argument('--translations',
+                        help='CSV file containing x,y offsets between images to improve tracking')
+    parser.add_argument('--rho-window', type=float, default=30,
+                        help='Maximum rho deviation of tracked lines from their prediction')
+    parser.add_argument('--theta-window', type=float, default=0.05,
+                        help='Maximum theta deviation of tracked lines from their prediction')
+    parser.add_argument('--canny-low', type=int, default=50,
+                        help='Lower threshold of Canny edge detection')
+    parser.add_argument('--canny-high', type=int, default=150,
+                        help='Upper threshold of Canny edge detection')
+    parser.add_argument('--edge-cache',
+                        help='File to cache edge maps in, reused by later runs with the same Canny thresholds')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip files that were completed by an earlier, interrupted run (regarded iff input is directory)')
 
     args = parser.parse_args()
 
-    if os.path.isdir(args.input):
-        if not args.output:
-            args.output = os.path.join(args.input, 'hough.csv')
-        hough_all(args.input, args.output,
-                  paint_output=args.paint,
-                  threshold=args.threshold,
-                  filterPredicate=(
-                      lambda l: naiveFilter(l, args.max_v_deviation)
-                  ) if args.max_v_deviation is not None else None,
-                  center=args.strategy == 'center',
-                  nubPredicate=naiveNubPredicate
-                  if args.strategy == 'nub' else None,
-                  verbose=args.verbose,
-                  max_workers=args.max_workers)
-    else:
-        lines = hough(args.input, outputfile=args.paint,
+    if args.track and args.strategy == 'rows':
+        print('Tracking is not available for strategy rows')
+        exit(1)
+
+    with (EdgeCache(args.edge_cache) if args.edge_cache
+          else contextlib.nullcontext()) as edge_cache:
+        if os.path.isdir(args.input):
+            if not args.output:
+                args.output = os.path.join(args.input, 'hough.csv')
+            hough_all(args.input, args.output,
+                      paint_output=args.paint,
                       threshold=args.threshold,
                       filterPredicate=(
                           lambda l: naiveFilter(l, args.max_v_deviation)
@@ -222,7 +579,41 @@ if __name__ == '__main__':
                       center=args.strategy == 'center',
                       nubPredicate=naiveNubPredicate
                       if args.strategy == 'nub' else None,
-                      verbose=args.verbose)
-        print('RESULT')
-        for line in lines:
-            print(ut.eq(line))
+                      verbose=args.verbose,
+                      max_workers=args.max_workers,
+                      track=args.track,
+                      translations=args.translations,
+                      rho_window=args.rho_window,
+                      theta_window=args.theta_window,
+                      fit_rows=args.strategy == 'rows',
+                      min_gradient=args.min_gradient,
+                      canny_low=args.canny_low,
+                      canny_high=args.canny_high,
+                      edge_cache=edge_cache,
+                      resume=args.resume)
+        elif args.strategy == 'rows':
+            lines = rowedges(args.input, outputfile=args.paint,
+                             min_gradient=args.min_gradient,
+                             filterPredicate=(
+                                 lambda l: naiveFilter(l, args.max_v_deviation)
+                             ) if args.max_v_deviation is not None else None,
+                             verbose=args.verbose)
+            print('RESULT')
+            for line in lines:
+                print(ut.eq(line))
+        else:
+            lines = hough(args.input, outputfile=args.paint,
+                          threshold=args.threshold,
+                          filterPredicate=(
+                              lambda l: naiveFilter(l, args.max_v_deviation)
+                          ) if args.max_v_deviation is not None else None,
+                          center=args.strategy == 'center',
+                          nubPredicate=naiveNubPredicate
+                          if args.strategy == 'nub' else None,
+                          canny_low=args.canny_low,
+                          canny_high=args.canny_high,
+                          edge_cache=edge_cache,
+                          verbose=args.verbose)
+            print('RESULT')
+            for line in lines:
+                print(ut.eq(line))
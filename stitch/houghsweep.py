@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+import contextlib
+import functools
+import os
+from concurrent import futures
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import framestore as fs
+from edgecache import EdgeCache
+import hough as ld
+import lineutils as ut
+from lineutils import r, t
+
+
+@functools.lru_cache()
+def trig_table(theta_step, min_theta=0, max_theta=np.pi):
+    """
+    Replicates the single precision lookup tables of cosine and sine values
+    that `cv.HoughLines` builds internally, including the rounding errors
+    of accumulating the angles in single precision.
+    """
+    count = int(np.rint((max_theta - min_theta) / theta_step))
+    step = np.float32(theta_step)
+    angles = np.empty(count, dtype=np.float32)
+    angle = np.float32(min_theta)
+    for n in range(count):
+        angles[n] = angle
+        angle = np.float32(angle + step)
+    angles = angles.astype(np.float64)
+    return np.cos(angles).astype(np.float32), np.sin(angles).astype(np.float32)
+
+
+def count_votes(edges, lines, theta_step=np.pi/180/100):
+    """
+    Computes the number of accumulator votes of the given raw Hough lines
+    in the same way `cv.HoughLines` does internally (one pixel rho steps).
+    Used if OpenCV is too old to provide `cv.HoughLinesWithAccumulator`.
+    """
+    cos_table, sin_table = trig_table(theta_step)
+    ys, xs = np.nonzero(edges)
+    xs, ys = xs.astype(np.float32), ys.astype(np.float32)
+    votes = []
+    for rho, theta in lines:
+        n = int(np.rint(theta / np.float32(theta_step)))
+        rs = np.rint(xs * cos_table[n] + ys * sin_table[n])
+        votes.append(int((rs == np.rint(rho)).sum()))
+    return votes
+
+
+def ranked_lines(imagefile, min_threshold, canny_low=50, canny_high=150, edge_cache=None):
+    """
+    Performs a single Hough transform with the most permissive threshold
+    and returns all lines along with their number of votes. A Hough transform
+    with any higher threshold `t` yields exactly those lines that have
+    more than `t` votes, so all of them can be derived from this result.
+    """
+    edges = ld.load_edges(imagefile, canny_low, canny_high, edge_cache=edge_cache)
+
+    if hasattr(cv, 'HoughLinesWithAccumulator'):
+        lines = cv.HoughLinesWithAccumulator(
+            edges, 1, np.pi/180/100, min_threshold)
+        if lines is None:
+            return [], []
+        lines = lines.reshape(-1, 3)
+        return [(rho, theta) for rho, theta, _ in lines], [v for _, _, v in lines]
+
+    lines = cv.HoughLines(edges, 1, np.pi/180/100, min_threshold)
+    if lines is None:
+        return [], []
+    lines = [(rho, theta) for rho, theta in lines.reshape(-1, 2)]
+    return lines, count_votes(edges, lines)
+
+
+def sweep(imagedir, output, thresholds, deviations,
+          center=True,
+          nubPredicate=None,
+          canny_low=50,
+          canny_high=150,
+          edge_cache=None,
+          max_workers=4):
+    """
+    Performs a grid search over Hough thresholds and maximum deviations
+    from the vertical line. Every image is read and edge-detected once
+    (or not at all if its edges are found in `edge_cache`).
+    Writes a CSV file of lines for each combination to
+    `output/<threshold>/<max deviation>/hough.csv` as well as a summary
+    of how many images had zero or one lines and how many lines were similar
+    to multiple centers (as reported by `hough.findCenters`)
+    to `output/summary.csv`.
+    """
+    files = sorted(fs.listdir(imagedir))
+    min_threshold = min(thresholds)
+
+    def helper_func(file):
+        lines, votes = ranked_lines(os.path.join(imagedir, file),
+                                    min_threshold,
+                                    canny_low=canny_low,
+                                    canny_high=canny_high,
+                                    edge_cache=edge_cache)
+        return [ut.normalize(l) for l in lines], np.array(votes)
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        ranked = list(tqdm(ex.map(helper_func, files), total=len(files)))
+
+    summary = []
+    for threshold in tqdm(thresholds):
+        # lines surviving this threshold
+        candidates = [[l for l, v in zip(lines, votes) if v > threshold]
+                      for lines, votes in ranked]
+        for deviation in deviations:
+            res = []
+            counts = []
+            multiple = 0
+            for file, lines in zip(files, candidates):
+                lines = ld.process_lines(lines,
+                                         normalize=False,
+                                         filterPredicate=lambda l: ld.naiveFilter(
+                                             l, deviation),
+                                         center=False,
+                                         nubPredicate=None if center else nubPredicate)
+                if center:
+                    # same as `hough.findCenters`, counting its messages
+                    groups, ambiguous = ld.groupLines(lines)
+                    lines = [np.array(group).mean(0) for group in groups]
+                    multiple += len(ambiguous)
+                counts.append(len(lines))
+                res += [[file, r(line), t(line)] for line in lines]
+
+            path = os.path.join(output, str(threshold), str(deviation))
+            os.makedirs(path, exist_ok=True)
+            df = pd.DataFrame(sorted(res), columns=['file', 'rho', 'theta'])
+            df.to_csv(os.path.join(path, 'hough.csv'), index=False)
+
+            counts = np.array(counts)
+            summary.append([threshold, deviation,
+                            (counts == 0).sum(),
+                            (counts == 1).sum(),
+                            multiple])
+
+    summary_file = os.path.join(output, 'summary.csv')
+    pd.DataFrame(summary,
+                 columns=['threshold', 'deviation', 'zero', 'one', 'multiple']
+                 ).to_csv(summary_file, index=False)
+    print('Done.', summary_file)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('input',
+                        help='Image directory')
+    parser.add_argument('output',
+                        help='Output directory')
+    parser.add_argument('-s', '--strategy', default='center', choices=['center', 'nub', 'none'],
+                        help='Use center of lines close to each other or filter out similar lines')
+    parser.add_argument('-t', '--thresholds', type=int, nargs='+', default=list(range(50, 251, 10)),
+                        help='Thresholds to use for Hough transformation')
+    parser.add_argument('-d', '--max-v-deviations', type=float, nargs='+',
+                        default=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8],
+                        help='Maximum deviations from the vertical line to filter lines by')
+    parser.add_argument('--canny-low', type=int, default=50,
+                        help='Lower threshold of Canny edge detection')
+    parser.add_argument('--canny-high', type=int, default=150,
+                        help='Upper threshold of Canny edge detection')
+    parser.add_argument('--edge-cache',
+                        help='File to cache edge maps in, reused by later runs with the same Canny thresholds')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='Maximum number of threads to use')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        print('Please prove a directory containing the image files')
+        exit(1)
+
+    with (EdgeCache(args.edge_cache) if args.edge_cache
+          else contextlib.nullcontext()) as edge_cache:
+        sweep(args.input, args.output, args.thresholds, args.max_v_deviations,
+              center=args.strategy == 'center',
+              nubPredicate=ld.naiveNubPredicate
+              if args.strategy == 'nub' else None,
+              canny_low=args.canny_low,
+              canny_high=args.canny_high,
+              edge_cache=edge_cache,
+              max_workers=args.max_workers)
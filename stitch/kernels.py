@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# Numerical kernels for the hot loops of `stitch.py`. They are compiled with
+# Numba if it is installed and run as plain NumPy otherwise. Both backends
+# perform the very same floating point operations in the very same order as
+# the scalar functions in `lineutils`, so they yield identical results.
+# Set STITCH_NO_JIT=1 to force the NumPy backend.
+
+import os
+
+import numpy as np
+
+from lineutils import normalize_all
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def squared_errors_np(c_rho, c_theta, n_rho, n_theta, tx, ty, alpha, image_height, alpha_b):
+    # one row per candidate translation, one column per line
+    tx, ty, alpha = tx[:, None], ty[:, None], alpha[:, None]
+
+    # current at origin of next
+    dist = np.sqrt(tx * tx + ty * ty)
+    c_theta = np.broadcast_to(c_theta, (len(tx), len(c_theta)))
+    c_rho, c_theta = normalize_all(c_rho - dist * np.cos(c_theta - alpha), c_theta)
+
+    # current and next at bottom border
+    cb_rho, cb_theta = normalize_all(c_rho - image_height * np.cos(c_theta - alpha_b), c_theta)
+    nb_rho, nb_theta = normalize_all(n_rho - image_height * np.cos(n_theta - alpha_b), n_theta)
+
+    # distance current <-> next, ditto at bottom border
+    top = n_rho / np.cos(n_theta) - c_rho / np.cos(c_theta)
+    bottom = nb_rho / np.cos(nb_theta) - cb_rho / np.cos(cb_theta)
+    squared = top * top + bottom * bottom
+
+    # summed up one line after another like the scalar version does
+    errors = np.zeros(len(squared))
+    for j in range(squared.shape[1]):
+        errors = errors + squared[:, j]
+    return errors
+
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def normalize_jit(r, t):
+        if r < 0:
+            r, t = -r, np.pi + t
+        while t < -np.pi:
+            t += 2 * np.pi
+        while t >= np.pi:
+            t -= 2 * np.pi
+        return r, t
+
+    @numba.njit(cache=True)
+    def squared_errors_jit(c_rho, c_theta, n_rho, n_theta, tx, ty, alpha, image_height, alpha_b):
+        # next lines and their roots do not depend on the translation
+        n_root = np.empty(len(n_rho))
+        nb_root = np.empty(len(n_rho))
+        for j in range(len(n_rho)):
+            n_root[j] = n_rho[j] / np.cos(n_theta[j])
+            r, t = normalize_jit(n_rho[j] - image_height * np.cos(n_theta[j] - alpha_b),
+                                 n_theta[j])
+            nb_root[j] = r / np.cos(t)
+
+        errors = np.empty(len(tx))
+        for i in range(len(tx)):
+            dist = np.sqrt(tx[i] * tx[i] + ty[i] * ty[i])
+            error = 0.0
+            for j in range(len(c_rho)):
+                r, t = normalize_jit(c_rho[j] - dist * np.cos(c_theta[j] - alpha[i]), c_theta[j])
+                rb, tb = normalize_jit(r - image_height * np.cos(t - alpha_b), t)
+                top = n_root[j] - r / np.cos(t)
+                bottom = nb_root[j] - rb / np.cos(tb)
+                error += top * top + bottom * bottom
+            errors[i] = error
+        return errors
+
+
+BACKEND = 'numba' if numba is not None and not os.environ.get('STITCH_NO_JIT') else 'numpy'
+
+
+def squared_errors(c_rho, c_theta, n_rho, n_theta, tx, ty, image_height, backend=None):
+    """
+    Computes `stitch.compute_error` for many candidate translations tx, ty
+    of the same lines at once and returns an array of errors.
+    """
+    tx = np.ascontiguousarray(tx, dtype=np.float64)
+    ty = np.ascontiguousarray(ty, dtype=np.float64)
+    # arc tangents are taken from NumPy in either case
+    # as the ones of LLVM may deviate in the last digit
+    alpha = np.arctan2(ty, tx)
+    alpha_b = np.arctan2(image_height, 0)
+    args = (np.ascontiguousarray(c_rho, dtype=np.float64),
+            np.ascontiguousarray(c_theta, dtype=np.float64),
+            np.ascontiguousarray(n_rho, dtype=np.float64),
+            np.ascontiguousarray(n_theta, dtype=np.float64),
+            tx, ty, alpha, float(image_height), float(alpha_b))
+    if (backend or BACKEND) == 'numba':
+        return squared_errors_jit(*args)
+    return squared_errors_np(*args)
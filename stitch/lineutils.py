@@ -284,3 +284,148 @@ def root(line):
     """
     rho, theta = line
     return rho / np.cos(theta)
+
+
+class LineSet:
+    """
+    `LineSet`s hold a number of lines as arrays of rho and theta values
+    along with the cosine and sine of theta and the coordinates of the
+    foot points, which are computed once upon instantiation.
+    Iterating over a `LineSet` yields (rho, theta) tuples, so it can be used
+    wherever a list of lines is expected. Indexing by an integer yields a
+    single line, indexing by a slice, mask or index array yields a `LineSet`.
+    """
+    __slots__ = ('rho', 'theta', 'cos', 'sin', 'x', 'y')
+
+    def __init__(self, rho=(), theta=()):
+        self.rho = np.asarray(rho)
+        self.theta = np.asarray(theta)
+        self.cos = np.cos(self.theta)
+        self.sin = np.sin(self.theta)
+        self.x = self.rho * self.cos
+        self.y = self.rho * self.sin
+
+    @classmethod
+    def from_lines(cls, lines, norm=True):
+        """
+        Creates a `LineSet` from (rho, theta) tuples,
+        normalizing them by default as specified by `normalize(line)`.
+        """
+        lines = list(lines)
+        # keep the precision of rho and theta, e.g. float32 as found by OpenCV
+        rho = np.array([r for r, _ in lines])
+        theta = np.array([t for _, t in lines])
+        return cls(*normalize_all(rho, theta)) if norm else cls(rho, theta)
+
+    def __len__(self):
+        return len(self.rho)
+
+    def __iter__(self):
+        return zip(self.rho, self.theta)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            return self.rho[index], self.theta[index]
+        return LineSet(self.rho[index], self.theta[index])
+
+    def __repr__(self):
+        return 'LineSet(' + str(list(self)) + ')'
+
+    def move_origin(self, x=0, y=0, norm=True):
+        """
+        Same as `move_origin(line, x, y, norm)` for all lines at once.
+        """
+        dist = np.sqrt(x * x + y * y)
+        alpha = np.arctan2(y, x)
+        rho = self.rho - dist * np.cos(self.theta - alpha)
+        return LineSet(*normalize_all(rho, self.theta)) if norm else LineSet(rho, self.theta)
+
+    def translate(self, x=0, y=0, norm=True):
+        """
+        Same as `translate(line, x, y, norm)` for all lines at once.
+        """
+        return self.move_origin(-x, -y, norm=norm)
+
+    def rotate(self, theta, x=0, y=0, norm=True):
+        """
+        Same as `rotate(line, theta, x, y, norm)` for all lines at once.
+        Angles and anchors may be given per line.
+        """
+        # moving the origin by 0, 0 does not change a line at all
+        moved = self.move_origin(x, y, norm=False)
+        return LineSet(moved.rho, moved.theta + theta).move_origin(-x, -y, norm=norm)
+
+    def bisect(self, other):
+        """
+        Same as `get_bisecting_line(l, r)` for all lines `l` of this
+        and lines `r` of the other `LineSet` at once.
+        """
+        theta = (self.theta + other.theta) / 2
+        intersect_l = np.tan(theta - self.theta) * self.rho
+        intersect_r = np.tan(theta - other.theta) * other.rho
+        xn_l = self.x + intersect_l * np.cos(np.pi/2 + self.theta)
+        yn_l = self.y + intersect_l * np.sin(np.pi/2 + self.theta)
+        xn_r = other.x + intersect_r * np.cos(np.pi/2 + other.theta)
+        yn_r = other.y + intersect_r * np.sin(np.pi/2 + other.theta)
+        x, y = (xn_l + xn_r) / 2, (yn_l + yn_r) / 2
+        return LineSet(np.sqrt(x * x + y * y), theta)
+
+    def vertical_distance(self, other):
+        """
+        Same as `vertical_distance(line0, line1)` for all lines `line0`
+        of this and lines `line1` of the other `LineSet` at once.
+        """
+        beta = -self.theta
+        sinbeta = np.sin(beta)
+        dist_x = self.x - other.x
+        dist_y = self.y - other.y
+        b = np.sqrt(dist_x * dist_x + dist_y * dist_y)
+        gamma = np.pi/2 + np.arctan2(dist_y, dist_x)
+        alpha = np.pi - beta - gamma
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.sin(alpha) * b / sinbeta
+        return np.where(sinbeta == 0, 0,
+                        np.where(dist_x == 0, dist_y, distance))
+
+    @staticmethod
+    def concat(linesets):
+        """
+        Joins the lines of the given `LineSet`s into a single one.
+        """
+        linesets = list(linesets)
+        if not linesets:
+            return LineSet()
+        return LineSet(np.concatenate([s.rho for s in linesets]),
+                       np.concatenate([s.theta for s in linesets]))
+
+    def similar_to(self, line, max_rho=30, max_theta=0.1):
+        """
+        Same as `are_lines_similar(l, line, max_rho, max_theta)`
+        for all lines `l` at once. Returns a boolean mask.
+        """
+        rho, theta = line
+        diff_t = np.abs(self.theta - theta)
+        similar = (np.abs(self.rho - rho) < max_rho) & (diff_t < max_theta)
+        similar_inverted = ((np.abs(self.rho + rho) < max_rho)
+                            & (np.abs(diff_t - np.pi) < max_theta))
+        return similar | similar_inverted
+
+
+def normalize_all(rho, theta):
+    """
+    Same as `normalize(line)` for arrays of rho and theta values.
+    """
+    negative = rho < 0
+    rho = np.where(negative, -rho, rho)
+    theta = np.where(negative, np.pi + theta, theta)
+    while True:
+        low = theta < -np.pi
+        if not low.any():
+            break
+        theta = np.where(low, theta + 2 * np.pi, theta)
+    while True:
+        high = theta >= np.pi
+        if not high.any():
+            break
+        theta = np.where(high, theta - 2 * np.pi, theta)
+    return rho, theta
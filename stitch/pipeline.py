@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# Bounded read-ahead and write-behind of images, so that decoding and encoding
+# (and waiting for slow, e.g. network-mounted, storage) overlap with the
+# computation done in between. Both directions limit the number of images
+# in flight as well as the memory they occupy.
+
+import collections
+from concurrent import futures
+
+import cv2 as cv
+
+import framestore as fs
+
+MEGABYTE = 1024 * 1024
+
+
+def prefetch(items, read=fs.imread, depth=8, max_memory=512, workers=2):
+    """
+    Applies `read` to all items (by default image paths) in background threads
+    and yields (item, result) in the order of the items. At most `depth`
+    items are read ahead, and fewer if the results read so far suggest that
+    they would exceed `max_memory` megabytes.
+    """
+    items = iter(items)
+    pending = collections.deque()
+    item_size = 0  # size of the last result, used to estimate the memory in flight
+
+    def size_of(result):
+        if isinstance(result, tuple):
+            return sum(size_of(r) for r in result)
+        return getattr(result, 'nbytes', 0)
+
+    def full():
+        return (len(pending) >= depth
+                or len(pending) * item_size >= max_memory * MEGABYTE)
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        exhausted = False
+        while True:
+            while not exhausted and (not pending or not full()):
+                item = next(items, StopIteration)
+                if item is StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, ex.submit(read, item)))
+            if not pending:
+                break
+            item, job = pending.popleft()
+            result = job.result()
+            item_size = size_of(result)
+            yield item, result
+
+
+class Writer:
+    """
+    Writes images in background threads. `write` returns immediately unless
+    `depth` images or `max_memory` megabytes are waiting to be written.
+    Use as a context manager to wait for all writes (and their errors) at the end.
+    """
+
+    def __init__(self, write=cv.imwrite, depth=8, max_memory=512, workers=2):
+        self._write = write
+        self.depth = depth
+        self.max_memory = max_memory
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self.pending = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _wait_oldest(self):
+        job, path, _ = self.pending.popleft()
+        if job.result() is False:
+            raise IOError('Could not write image ' + path)
+
+    def write(self, path, img):
+        while self.pending and (len(self.pending) >= self.depth
+                                or sum(n for _, _, n in self.pending) + img.nbytes
+                                > self.max_memory * MEGABYTE):
+            self._wait_oldest()
+        self.pending.append((self.executor.submit(self._write, path, img), path, img.nbytes))
+
+    def close(self):
+        try:
+            while self.pending:
+                self._wait_oldest()
+        finally:
+            self.executor.shutdown()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import kernels
+import stitch as st
+
+ROTATIONS = {'default': False, 'reverse': True}
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def windows(centers, radius):
+    """
+    Returns the boxes (x0, y0, width, height) of error surfaces to compute
+    so that the window of the given L∞ radius around each center is covered.
+    Close centers share a box, distant ones get a box each.
+    """
+    side = 2 * radius + 1
+    (x_min, y_min), (x_max, y_max) = np.min(centers, 0), np.max(centers, 0)
+    width, height = x_max - x_min + side, y_max - y_min + side
+    if width * height <= len(centers) * side * side:
+        return [(x_min - radius, y_min - radius, width, height)]
+    return [(x - radius, y - radius, side, side) for x, y in sorted(set(centers))]
+
+
+def error_surfaces(cachefile, image_height, max_radius):
+    """
+    Computes the analytical estimates of all pairs of images for both
+    settings of `reverse_rotation` and the error function on all translations
+    within `max_radius` of them. Returns a dict of arrays as stored by
+    `write_surfaces`.
+    """
+    print('Reading Hough lines')
+    df = pd.read_csv(cachefile)
+    line_files = [st.LineImage(file, list(zip(group_df['rho'], group_df['theta'])))
+                  for file, group_df in df.groupby(by='file')]
+    image_pairs = list(zip(line_files, line_files[1:]))
+
+    # twins and estimates are the same for every radius
+    line_pairs_list = [st.twin_lines(current_image, next_image)
+                       for current_image, next_image in image_pairs]
+    estimates = np.stack([st.analytical_estimates(line_pairs_list, reverse_rotation=rr)
+                          for rr in ROTATIONS.values()], axis=1)
+
+    boxes, errors = [], []
+    offset = 0
+    for i, (line_pairs, estimate) in enumerate(zip(tqdm(line_pairs_list), estimates)):
+        if np.isnan(estimate).any():
+            continue
+        centers = [tuple(center) for center in np.rint(estimate).astype(int)]
+        for x0, y0, width, height in windows(centers, max_radius):
+            # same order of attempts as `stitch.optimize_line_distances`
+            xs, ys = np.meshgrid(np.arange(x0, x0 + width), np.arange(y0, y0 + height),
+                                 indexing='ij')
+            c, n = line_pairs
+            errors.append(kernels.squared_errors(c.rho, c.theta, n.rho, n.theta,
+                                                 xs.ravel(), ys.ravel(), image_height))
+            boxes.append((i, x0, y0, width, height, offset))
+            offset += width * height
+
+    return {
+        'files': np.array([current_image.img_path for current_image, _ in image_pairs]),
+        'refs': np.array([next_image.img_path for _, next_image in image_pairs]),
+        'estimates': estimates,
+        'boxes': np.array(boxes, dtype=np.int64).reshape(-1, 6),
+        'errors': np.concatenate(errors) if errors else np.zeros(0),
+        'image_height': np.array(image_height),
+        'max_radius': np.array(max_radius),
+        'hough': np.array(file_hash(cachefile)),
+    }
+
+
+def write_surfaces(surfaces, path):
+    """
+    Stores error surfaces in a single compressed file by replacing it atomically.
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.savez_compressed(f, **surfaces)
+    os.replace(path + '.tmp', path)
+
+
+def read_surfaces(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def translations_for(surfaces, radius, reverse_rotation=False):
+    """
+    Answers the local optimization with the given L∞ radius (at most the one
+    the surfaces were computed with) for all pairs of images from the stored
+    error surfaces. Returns the translations as a dict like `stitch` produces
+    along with the error of each translation (NaN if there is no estimate)
+    and whether it lies on the border of its window.
+    """
+    column = list(ROTATIONS.values()).index(reverse_rotation)
+    boxes_per_pair = {}
+    for box in surfaces['boxes']:
+        boxes_per_pair.setdefault(box[0], []).append(box[1:])
+
+    translations, errors, border = {}, [], []
+    for i, (file, ref) in enumerate(zip(surfaces['files'], surfaces['refs'])):
+        estimate = surfaces['estimates'][i, column]
+        if np.isnan(estimate).any():
+            print('WARNING:', 'Insufficient lines in analytical mode for image pair', file, ref)
+            translations[file] = (ref, (0, 0))
+            errors.append(np.nan)
+            border.append(False)
+            continue
+
+        cx, cy = np.rint(estimate).astype(int)
+        for x0, y0, width, height, offset in boxes_per_pair[i]:
+            if x0 <= cx - radius and cx + radius < x0 + width \
+                    and y0 <= cy - radius and cy + radius < y0 + height:
+                break
+        surface = surfaces['errors'][offset:offset + width * height].reshape(width, height)
+        window = surface[cx - radius - x0:cx + radius + 1 - x0,
+                         cy - radius - y0:cy + radius + 1 - y0]
+
+        # first minimum in the order of attempts, just like np.argmin in `stitch`
+        k = np.argmin(window)
+        dx, dy = divmod(k, 2 * radius + 1)
+        translations[file] = (ref, (int(cx - radius + dx), int(cy - radius + dy)))
+        errors.append(window.flat[k])
+        border.append(radius > 0 and (0 in (dx, dy) or 2 * radius in (dx, dy)))
+
+    return translations, np.array(errors), np.array(border)
+
+
+def sweep(cachefile, image_height, output, radii, surfacefile=None):
+    """
+    Performs local optimization with all given L∞ radii and both settings of
+    `reverse_rotation` from error surfaces computed once at the maximum radius.
+    Writes the translations of each combination to
+    `output/<radius>/<rotation>/translations.csv` as well as a summary of
+    the mean error and the number of optima on the border of their window
+    to `output/summary.csv`. Surfaces are kept in `surfacefile`, if given,
+    and reused by later sweeps of the same Hough lines and image height
+    and no larger radius.
+    """
+    max_radius = max(radii)
+    surfaces = None
+    if surfacefile is not None and os.path.isfile(surfacefile):
+        surfaces = read_surfaces(surfacefile)
+        if (surfaces['hough'] != file_hash(cachefile)
+                or surfaces['image_height'] != image_height
+                or surfaces['max_radius'] < max_radius):
+            print('Error surfaces in', surfacefile, 'do not cover this sweep, computing them again')
+            surfaces = None
+        else:
+            print('Reusing error surfaces of', surfacefile)
+    if surfaces is None:
+        surfaces = error_surfaces(cachefile, image_height, max_radius)
+        if surfacefile is not None:
+            write_surfaces(surfaces, surfacefile)
+
+    summary = []
+    for radius in sorted(radii):
+        for rotation, reverse_rotation in ROTATIONS.items():
+            translations, errors, border = translations_for(surfaces, radius,
+                                                            reverse_rotation=reverse_rotation)
+            path = os.path.join(output, str(radius), rotation)
+            os.makedirs(path, exist_ok=True)
+            st.write_translations(translations, os.path.join(path, 'translations.csv'))
+            summary.append([radius, rotation,
+                            np.nanmean(errors) if (~np.isnan(errors)).any() else np.nan,
+                            border.sum(),
+                            np.isnan(errors).sum()])
+
+    summary_file = os.path.join(output, 'summary.csv')
+    pd.DataFrame(summary,
+                 columns=['radius', 'rotation', 'mean_error', 'border', 'failed']
+                 ).to_csv(summary_file, index=False)
+    print('Done.', summary_file)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('hough',
+                        help='File containing precomputed hough lines')
+    parser.add_argument('height', type=int,
+                        help='Image height')
+    parser.add_argument('output',
+                        help='Output directory')
+    parser.add_argument('-l', '--local-optimization', type=int, nargs='+',
+                        default=[0, 5, 10, 20, 30, 50],
+                        help='Maximum L∞ radii of local optimization to try')
+    parser.add_argument('--surfaces',
+                        help='File to keep the error surfaces in for later sweeps')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.hough):
+        print('Please provide a CSV file containing Hough lines')
+        exit(1)
+
+    sweep(args.hough, args.height, args.output, args.local_optimization,
+          surfacefile=args.surfaces)
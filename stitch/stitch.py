@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 
+import csv
+import functools
+import io
 import os
+import time
 
 import cv2 as cv
 import numpy as np
@@ -9,8 +13,10 @@ from scipy import optimize as so
 import pandas as pd
 from tqdm import tqdm
 
-import hough as ld
+import framestore as fs
+import kernels
 import lineutils as ut
+import pipeline as pl
 from lineutils import r, t, x, y
 
 
@@ -20,12 +26,16 @@ def fst(x): return x[0]
 def snd(x): return x[1]
 
 
-def stitch(method, imagedir, image_height, cachefile, lInfRadius=50, reverse_rotation=False, output=None):
+def stitch(method, imagedir, image_height, cachefile, lInfRadius=50, reverse_rotation=False, output=None,
+           resume=False, checkpoint=100, phase_scale=0.25, prior_tolerance=None, adaptive=False):
 
-    print('Reading Hough lines')
-    df = pd.read_csv(cachefile)
-    lines_per_file = {file: list(zip(group_df['rho'], group_df['theta']))
-                      for file, group_df in df.groupby(by='file')}
+    if cachefile is not None:
+        print('Reading Hough lines')
+        df = pd.read_csv(cachefile)
+        lines_per_file = {file: list(zip(group_df['rho'], group_df['theta']))
+                          for file, group_df in df.groupby(by='file')}
+    else:  # method == 'phase' does without lines
+        lines_per_file = {file: [] for file in fs.list_images(imagedir)}
     line_files = [LineImage(os.path.join(imagedir, p), l)
                   for p, l
                   in sorted(lines_per_file.items(), key=fst)]
@@ -33,269 +43,651 @@ def stitch(method, imagedir, image_height, cachefile, lInfRadius=50, reverse_rot
     # dict holding final translation values
     translations = {}
 
-    # pairs of images n and n+1
-    for current_image, next_image in tqdm(zip(line_files, line_files[1:]), total=len(line_files) - 1):
-
-        # find out which line in the current image
-        # corresponds to which line in the next image
-
-        # we call these pairs twins
-        current_image.init_twins(next_image)
-
-        # current lines
-        c_lines = current_image.lines
-        # next lines
-        n_lines = [current_image.twins[line]
-                   if line in current_image.twins
-                   else None
-                   for line in c_lines]
-
-        # filter out entries where no twin was found
-        line_pairs = list(
-            filter(
-                lambda p: p[1] is not None,
-                zip(c_lines,
-                    n_lines)
-            )
-        )
-
-        if method == 'analytical':
-
-            # we need two twins (that is, four lines) for each translation computation,
-            # so we generate all possible combinations of twins (pairs of twins)
-            count = len(line_pairs)
-            twin_combinations = [(line_pairs[l], line_pairs[r])
-                                 for l in range(0, count)
-                                 for r in range(l + 1, count)]
-
-            # translation values for each pair of twins
-            image_translations = []
-
-            # Naming conventions:
-            # Prefix c_ stands for C_urrent set of lines
-            # Prefix n_ stands for N_ext set of lines
-            # Postfix _l stands for _Left line
-            # Postfix _b stands for _Bisection line
-            # Postfix _r stands for _Right line
-            # x means x coord, y means y coord of foot point
-            # rho, theta are simply x, y in polar coords
-
-            #   left twin   right twin
-            for (c_l, n_l), (c_r, n_r) in twin_combinations:
-
-                # Compute bisecting lines
-                c_b = ut.get_bisecting_line(c_l, c_r)
-                n_b = ut.get_bisecting_line(n_l, n_r)
-
-                # We might need the original lines later on
-                c_b_backup, n_b_backup = c_b, n_b
-
-                # Move this distance to align bisec foot points
-                x_diff_b, y_diff_b = x(n_b) - x(c_b), y(n_b) - y(c_b)
-
-                # Use these four variables to track the overall vertical translation for each side
-                translate_x_l = x_diff_b
-                translate_x_r = x_diff_b
-                translate_y_l = y_diff_b
-                translate_y_r = y_diff_b
-
-                # Move current lines
-                c_l = ut.translate(c_l, x_diff_b, y_diff_b)
-                c_b = ut.translate(c_b, x_diff_b, y_diff_b)
-                c_r = ut.translate(c_r, x_diff_b, y_diff_b)
-
-                # Foot points should now be "equal" (deviate less than 1 pixel) for the bisecting lines
-                bft_x, bft_y = x(n_b), y(n_b)  # = x(c_b), y(c_b)
-
-                # Rotate current lines and next lines
-                # such that the bisection lines are both vertical
-                c_rotate, n_rotate = -t(c_b), -t(n_b)
-                c_l = ut.rotate(c_l, c_rotate, bft_x, bft_y)
-                c_b = ut.rotate(c_b, c_rotate, bft_x, bft_y)
-                c_r = ut.rotate(c_r, c_rotate, bft_x, bft_y)
-                n_l = ut.rotate(n_l, n_rotate, bft_x, bft_y)
-                n_b = ut.rotate(n_b, n_rotate, bft_x, bft_y)
-                n_r = ut.rotate(n_r, n_rotate, bft_x, bft_y)
-
-                if reverse_rotation:
-                    # Compute how far both current lines
-                    # need to be translated in vertical direction
-                    # to match both next lines
-                    translate_l = ut.vertical_distance(n_l, c_l)
-                    translate_r = ut.vertical_distance(n_r, c_r)
-
-                    # As we rotated the lines earlier,
-                    # vertical actually refers to parallel to the bisections,
-                    # so we need to take them into account
-                    # (We use the bisection of the bisections as a simplifying assumption)
-                    vertical_direction = t(ut.get_bisecting_line(c_b_backup,
-                                                                 n_b_backup))
-
-                    # Distribute vertical translations among both axes according to bisection of bisections
-                    # (Note how we swapped sin and cos to account for the pi/2 angle of difference)
-                    translate_x_l += translate_l * np.sin(vertical_direction)
-                    translate_x_r += translate_r * np.sin(vertical_direction)
-                    translate_y_l += translate_l * np.cos(vertical_direction)
-                    translate_y_r += translate_r * np.cos(vertical_direction)
-
-                    # Take the average over both translation for left and right
-                    translate_x = (translate_x_l + translate_x_r) / 2
-                    translate_y = (translate_y_l + translate_y_r) / 2
-                else:
-                    # We do not take into account that we rotated our lines earlier because experiments show that this produces worse results.
-
-                    # Compute how far the current lines
-                    # need to be translated in vertical direction
-                    # to match the next lines
-                    translate_y_l += ut.vertical_distance(n_l, c_l)
-                    translate_y_r += ut.vertical_distance(n_r, c_r)
-
-                    # The only time we translated horizontally was in the beginning, so we just copy that value
-                    translate_x = translate_x_l  # = translate_x_r
-                    # Take the average over both translation for left and right
-                    translate_y = 0.5 * (translate_y_l + translate_y_r)
-
-                # Store our translation results for the twin combination
-                image_translations.append([translate_x, translate_y])
-
-            if len(image_translations) > 0:
-                # average over all values and round to pixel accuracy
-                translation = np.rint(
-                    np.array(image_translations)
-                    .mean(0)
-                ).astype(int)
-
-                if lInfRadius > 0:
-                    # Optimize result based on error function
-                    translation = optimize_line_distances(
-                        line_pairs, translation, image_height,
-                        lInfRadius=lInfRadius
-                    )
+    if resume and output is not None and os.path.isfile(output):
+        translations = read_translations(output)
+        print('Resuming after', len(translations), 'completed pair(s)')
+
+    # pairs of images n and n+1, skipping those completed before
+    image_pairs = [(current_image, next_image)
+                   for current_image, next_image in zip(line_files, line_files[1:])
+                   if os.path.basename(current_image.img_path) not in translations]
+
+    if method == 'analytical':
+        # estimate the translations of all pairs of images at once
+        line_pairs_list = [twin_lines(current_image, next_image)
+                           for current_image, next_image in image_pairs]
+        estimates = analytical_estimates(line_pairs_list,
+                                         reverse_rotation=reverse_rotation)
+        # size the window of local optimization by the translations so far
+        radii = AdaptiveRadius(lInfRadius) if adaptive else None
+    elif method == 'phase':
+        # read every image once and ahead of time
+        frames = phase_frames(image_pairs, scale=phase_scale)
+
+    try:
+        for i, (current_image, next_image) in enumerate(tqdm(image_pairs)):
+
+            if method == 'analytical':
+                translation = refine_estimate(estimates[i], line_pairs_list[i], image_height,
+                                              lInfRadius=lInfRadius, adaptive=radii)
+                if translation is None:
+                    translation = (0, 0)
+                    print('WARNING:', 'Insufficient lines in analytical mode for image pair',
+                          current_image, next_image)
+            elif method == 'phase':
+                current_frame, next_frame = next(frames)
+                translation = solve_phase(current_image, next_image, image_height,
+                                          current_frame=current_frame, next_frame=next_frame,
+                                          scale=phase_scale,
+                                          lInfRadius=lInfRadius,
+                                          prior_tolerance=prior_tolerance)
             else:
-                translation = (0, 0)
-                print('WARNING:', 'Insufficient lines in analytical mode for image pair',
-                      current_image, next_image)
-
-        else:  # method == 'iterative'
-            res = so.minimize(
-                lambda t: compute_error(line_pairs, t, image_height),
-                (0, 0)
-            )
-            translation = tuple(map(int, map(round, res.x)))
+                translation = solve_pair(method, current_image, next_image, image_height,
+                                         lInfRadius=lInfRadius,
+                                         reverse_rotation=reverse_rotation)
+
+            # store reference image and translation value in result dict
+            key = os.path.basename(current_image.img_path)
+            ref = os.path.basename(next_image.img_path)
+            translations[key] = (ref, translation)
+
+            if output is not None and checkpoint and (i + 1) % checkpoint == 0:
+                write_translations(translations, output)
+    finally:
+        # keep what was computed so far if we are interrupted
+        if output is not None:
+            write_translations(translations, output)
+
+    if method == 'analytical' and adaptive and radii.radii:
+        print('Mean L∞ radius of local optimization:', round(np.mean(radii.radii), 1),
+              'instead of', lInfRadius)
+    if output is not None:
+        print('Done.', output)
+    else:
+        print('Done. Result:')
+        print(translations_frame(translations))
+        print('Result not written to disk as output file was not specified.')
 
-        # store reference image and translation value in result dict
-        key = os.path.basename(current_image.img_path)
-        ref = os.path.basename(next_image.img_path)
-        translations[key] = (ref, translation)
 
+def translations_frame(translations):
     paths = list(sorted(translations.keys()))
     refs = [translations[p][0] for p in paths]
     xs = [translations[p][1][0] for p in paths]
     ys = [translations[p][1][1] for p in paths]
-    df = pd.DataFrame({'ref': refs, 'x': xs, 'y': ys}, index=paths)
-    if output is not None:
-        print('Done.', output)
-        df.to_csv(output)
+    return pd.DataFrame({'ref': refs, 'x': xs, 'y': ys}, index=paths)
+
+
+def write_translations(translations, output):
+    """
+    Writes translations to a CSV file by replacing it atomically,
+    so that it is never left behind half-written.
+    """
+    translations_frame(translations).to_csv(output + '.tmp')
+    os.replace(output + '.tmp', output)
+
+
+def read_translations(output):
+    """
+    Reads translations as written by `write_translations`.
+    """
+    df = pd.read_csv(output, index_col=0)
+    return {file: (ref, (x, y))
+            for file, ref, x, y in zip(df.index, df['ref'], df['x'], df['y'])}
+
+
+def read_lines(cachefile, follow=0, interval=1):
+    """
+    Reads a CSV file of Hough lines that is sorted by file name
+    and yields the lines of one file after another as (file, lines).
+    If `follow` is positive, rows that are appended to the file
+    (e.g. by a running `hough.py`) will be read, too, until the file
+    did not grow for `follow` seconds.
+    """
+    def parse(rows):
+        # parse like `stitch` does, so that both yield the very same floats
+        df = pd.read_csv(io.StringIO(header + ''.join(rows)))
+        return list(zip(df['rho'], df['theta']))
+
+    header, column = None, None
+    current, rows = None, []
+    pending = ''
+    idle = 0
+    with open(cachefile, newline='') as f:
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                if idle >= follow:
+                    break
+                time.sleep(interval)
+                idle += interval
+                continue
+            idle = 0
+
+            # rows might be read while they are being written
+            pending += chunk
+            if not pending.endswith('\n') and follow > 0:
+                continue
+            line, pending = pending, ''
+
+            if header is None:
+                header = line
+                column = next(csv.reader([line])).index('file')
+                continue
+            file = next(csv.reader([line]))[column]
+
+            # a file's lines are complete once the next file begins
+            if file != current:
+                if current is not None:
+                    yield current, parse(rows)
+                current, rows = file, []
+            rows.append(line)
+
+    if current is not None:
+        yield current, parse(rows)
+
+
+def stitch_stream(method, imagedir, image_height, lines_per_file,
+                  lInfRadius=50, reverse_rotation=False, phase_scale=0.25, prior_tolerance=None,
+                  adaptive=False, done=()):
+    """
+    Streaming version of `stitch`. Consumes (file, lines) tuples in order of
+    the files and yields (file, ref, x, y) as soon as the translation
+    of a pair of images is known. Only the previous image is kept in memory.
+    Pairs starting at a file in `done` are skipped.
+    """
+    radii = AdaptiveRadius(lInfRadius) if adaptive else None
+    previous = None
+    for file, lines in lines_per_file:
+        current = LineImage(os.path.join(imagedir, file), lines)
+        if previous is not None and os.path.basename(previous.img_path) not in done:
+            tx, ty = solve_pair(method, previous, current, image_height,
+                                lInfRadius=lInfRadius,
+                                reverse_rotation=reverse_rotation,
+                                phase_scale=phase_scale,
+                                prior_tolerance=prior_tolerance,
+                                adaptive=radii)
+            yield os.path.basename(previous.img_path), file, int(tx), int(ty)
+        previous = current
+
+
+def stitch_incremental(method, imagedir, image_height, cachefile,
+                       lInfRadius=50, reverse_rotation=False, output=None, follow=0,
+                       phase_scale=0.25, prior_tolerance=None, adaptive=False, resume=False):
+    """
+    Performs stitching like `stitch`, but appends each translation
+    to the output file (or prints it) as soon as it is computed.
+    If `resume` is set, pairs already contained in the output file
+    are skipped and new ones are appended to it.
+    """
+    done = None
+    if resume and output is not None and os.path.isfile(output):
+        with open(output, newline='') as f:
+            lines = f.readlines()
+        if lines and lines[0].endswith('\n'):
+            # drop a row that may have been written partially
+            header, *rows = lines
+            rows = [row for row in rows if row.endswith('\n')]
+            with open(output, 'w', newline='') as f:
+                f.writelines([header] + rows)
+            done = set(next(csv.reader([row]))[0] for row in rows)
+            print('Resuming after', len(done), 'completed pair(s)')
+
+    results = stitch_stream(method, imagedir, image_height,
+                            read_lines(cachefile, follow=follow),
+                            lInfRadius=lInfRadius,
+                            reverse_rotation=reverse_rotation,
+                            phase_scale=phase_scale,
+                            prior_tolerance=prior_tolerance,
+                            adaptive=adaptive,
+                            done=done or ())
+    if output is None:
+        for row in results:
+            print(*row, sep=',')
+        return
+
+    with open(output, 'w' if done is None else 'a', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        if done is None:
+            writer.writerow(['', 'ref', 'x', 'y'])
+            f.flush()
+        for row in tqdm(results):
+            writer.writerow(row)
+            f.flush()
+    print('Done.', output)
+
+
+def solve_pair(method, current_image, next_image, image_height,
+               lInfRadius=50, reverse_rotation=False, phase_scale=0.25, prior_tolerance=None,
+               adaptive=None):
+    """
+    Computes the translation between two `LineImage`s
+    using the given method. `adaptive` is an optional `AdaptiveRadius`
+    for method analytical.
+    """
+    if method == 'phase':
+        return solve_phase(current_image, next_image, image_height,
+                           scale=phase_scale, lInfRadius=lInfRadius,
+                           prior_tolerance=prior_tolerance)
+
+    line_pairs = twin_lines(current_image, next_image)
+
+    if method == 'analytical':
+        estimate, = analytical_estimates([line_pairs],
+                                         reverse_rotation=reverse_rotation)
+        translation = refine_estimate(estimate, line_pairs, image_height,
+                                      lInfRadius=lInfRadius, adaptive=adaptive)
+        if translation is None:
+            translation = (0, 0)
+            print('WARNING:', 'Insufficient lines in analytical mode for image pair',
+                  current_image, next_image)
+
+    else:  # method == 'iterative'
+        res = so.minimize(
+            lambda t: compute_error(line_pairs, t, image_height),
+            (0, 0)
+        )
+        translation = tuple(map(int, map(round, res.x)))
+
+    return translation
+
+
+def blade_mask(shape, lines, scale=1.0):
+    """
+    Returns a boolean mask of the given shape that is true between the leftmost
+    and the rightmost of the given `LineSet`, i.e. on the blade. Lines are given
+    in coordinates of the image before it was scaled by `scale`.
+    """
+    height, width = shape
+    ys = (np.arange(height) + 0.5) / scale
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xs = (lines.rho[:, None] - ys[None, :] * lines.sin[:, None]) / lines.cos[:, None]
+    left, right = xs.min(0) * scale, xs.max(0) * scale
+    columns = np.arange(width) + 0.5
+    return (columns[None, :] >= left[:, None]) & (columns[None, :] <= right[:, None])
+
+
+def phase_frame(image, scale=0.25):
+    """
+    Reads the image of a `LineImage` as a downscaled grayscale image for
+    phase correlation. Given at least two lines, everything besides the blade
+    is replaced by the blade's mean, so that the background, which moves
+    differently than the blade, does not contribute to the correlation.
+    """
+    gray = fs.imread(image.img_path, cv.IMREAD_GRAYSCALE)
+    frame = cv.resize(gray, None, fx=scale, fy=scale,
+                      interpolation=cv.INTER_AREA).astype(np.float32)
+    if len(image.lines) >= 2:
+        mask = blade_mask(frame.shape, image.lines, scale)
+        if mask.any():
+            frame[~mask] = frame[mask].mean()
+    return frame
+
+
+def phase_frames(image_pairs, scale=0.25, prefetch=8):
+    """
+    Yields the frames of `phase_frame` for pairs of `LineImage`s as
+    (current, next), reading them ahead of time. Images shared by
+    consecutive pairs are only read once.
+    """
+    images = []
+    for pair in image_pairs:
+        for image in pair:
+            if not images or images[-1] is not image:
+                images.append(image)
+    frames = pl.prefetch(images, read=functools.partial(phase_frame, scale=scale),
+                         depth=prefetch)
+
+    read = {}
+    for current_image, next_image in image_pairs:
+        while next_image not in read:
+            image, frame = next(frames)
+            read[image] = frame
+        yield read[current_image], read[next_image]
+        read = {next_image: read[next_image]}
+
+
+@functools.lru_cache()
+def hanning_window(shape):
+    return cv.createHanningWindow(shape[::-1], cv.CV_32F)
+
+
+def phase_shift(current_frame, next_frame, scale=0.25):
+    """
+    Estimates the translation between two frames of `phase_frame` by phase
+    correlation with subpixel accuracy. Returns the translation in pixels
+    of the original images and the response of the correlation peak.
+    """
+    # apply the window to copies as some versions of OpenCV modify the frames in place,
+    # which are shared among consecutive pairs
+    window = hanning_window(current_frame.shape)
+    (dx, dy), response = cv.phaseCorrelate(current_frame * window, next_frame * window)
+    # the next image is placed at the translation relative to the current one,
+    # so its content is shifted by the opposite
+    return (-dx / scale, -dy / scale), response
+
+
+def solve_phase(current_image, next_image, image_height, current_frame=None, next_frame=None,
+                scale=0.25, lInfRadius=50, prior_tolerance=None):
+    """
+    Computes the translation between two `LineImage`s by phase correlation
+    of their images (or the given frames of `phase_frame`). If `prior_tolerance`
+    is given, a translation deviating more than this many pixels from the one
+    the Hough lines suggest (given at least two twins) is replaced by the latter.
+    Failed correlations yield (0, 0) otherwise.
+    """
+    if current_frame is None:
+        current_frame = phase_frame(current_image, scale)
+    if next_frame is None:
+        next_frame = phase_frame(next_image, scale)
+    (tx, ty), _ = phase_shift(current_frame, next_frame, scale)
+    translation = (int(round(tx)), int(round(ty)))
+
+    # a weak correlation peak may yield a shift beyond the frame
+    height, width = current_frame.shape
+    plausible = abs(tx) * scale < width / 2 and abs(ty) * scale < height / 2
+    if not plausible:
+        print('WARNING:', 'Phase correlation failed for image pair',
+              current_image.img_path, next_image.img_path)
+        translation = (0, 0)
+
+    if prior_tolerance is not None:
+        line_pairs = twin_lines(current_image, next_image)
+        if len(line_pairs[0]) >= 2:
+            estimate, = analytical_estimates([line_pairs])
+            prior = tuple(map(int, refine_estimate(estimate, line_pairs, image_height,
+                                                   lInfRadius=lInfRadius)))
+            if (not plausible
+                    or max(abs(translation[0] - prior[0]),
+                           abs(translation[1] - prior[1])) > prior_tolerance):
+                print('WARNING:', 'Using translation', prior, 'of Hough lines instead of',
+                      translation, 'of phase correlation for image pair',
+                      current_image.img_path, next_image.img_path)
+                translation = prior
+
+    return translation
+
+
+def twin_lines(current_image, next_image):
+    """
+    Matches the lines of two `LineImage`s and returns a pair of `LineSet`s
+    holding the lines of the current image that have a twin
+    and their twins in the next image, respectively.
+    """
+
+    # find out which line in the current image
+    # corresponds to which line in the next image
+
+    # we call these pairs twins
+    current_image.init_twins(next_image)
+
+    # filter out lines where no twin was found
+    found = current_image.twins >= 0
+    # current lines
+    c_lines = current_image.lines[found]
+    # next lines
+    n_lines = next_image.lines[current_image.twins[found]]
+
+    return c_lines, n_lines
+
+
+def analytical_estimates(line_pairs_list, reverse_rotation=False):
+    """
+    Takes a list of pairs of `LineSet`s as returned by `twin_lines`,
+    one per pair of images, and computes an unrounded translation for each
+    of them. Every combination of two twins (that is, four lines) yields a
+    translation, and these are averaged per pair of images. The combinations
+    of all pairs of images are computed at once. Returns an array of shape
+    (N, 2) which holds NaN for pairs with less than two twins.
+    """
+
+    # we need two twins (that is, four lines) for each translation computation,
+    # so we generate all possible combinations of twins (pairs of twins)
+    # and remember which pair of images each combination belongs to
+    c_l, n_l, c_r, n_r, owners = [], [], [], [], []
+    for i, (c_lines, n_lines) in enumerate(line_pairs_list):
+        left, right = np.triu_indices(len(c_lines), 1)
+        c_l.append(c_lines[left])
+        n_l.append(n_lines[left])
+        c_r.append(c_lines[right])
+        n_r.append(n_lines[right])
+        owners.append(np.full(len(left), i))
+    c_l, n_l, c_r, n_r = map(ut.LineSet.concat, (c_l, n_l, c_r, n_r))
+    owners = np.concatenate(owners) if owners else np.zeros(0, dtype=int)
+
+    # Naming conventions:
+    # Prefix c_ stands for C_urrent set of lines
+    # Prefix n_ stands for N_ext set of lines
+    # Postfix _l stands for _Left line
+    # Postfix _b stands for _Bisection line
+    # Postfix _r stands for _Right line
+    # Every variable holds one value (or line) per twin combination
+
+    # Compute bisecting lines
+    c_b = c_l.bisect(c_r)
+    n_b = n_l.bisect(n_r)
+
+    # We might need the original lines later on
+    c_b_backup, n_b_backup = c_b, n_b
+
+    # Move this distance to align bisec foot points
+    x_diff_b, y_diff_b = n_b.x - c_b.x, n_b.y - c_b.y
+
+    # Use these four variables to track the overall vertical translation for each side
+    translate_x_l = x_diff_b
+    translate_x_r = x_diff_b
+    translate_y_l = y_diff_b
+    translate_y_r = y_diff_b
+
+    # Move current lines
+    c_l = c_l.translate(x_diff_b, y_diff_b)
+    c_b = c_b.translate(x_diff_b, y_diff_b)
+    c_r = c_r.translate(x_diff_b, y_diff_b)
+
+    # Foot points should now be "equal" (deviate less than 1 pixel) for the bisecting lines
+    bft_x, bft_y = n_b.x, n_b.y  # = c_b.x, c_b.y
+
+    # Rotate current lines and next lines
+    # such that the bisection lines are both vertical
+    c_rotate, n_rotate = -c_b.theta, -n_b.theta
+    c_l = c_l.rotate(c_rotate, bft_x, bft_y)
+    c_b = c_b.rotate(c_rotate, bft_x, bft_y)
+    c_r = c_r.rotate(c_rotate, bft_x, bft_y)
+    n_l = n_l.rotate(n_rotate, bft_x, bft_y)
+    n_b = n_b.rotate(n_rotate, bft_x, bft_y)
+    n_r = n_r.rotate(n_rotate, bft_x, bft_y)
+
+    if reverse_rotation:
+        # Compute how far both current lines
+        # need to be translated in vertical direction
+        # to match both next lines
+        translate_l = n_l.vertical_distance(c_l)
+        translate_r = n_r.vertical_distance(c_r)
+
+        # As we rotated the lines earlier,
+        # vertical actually refers to parallel to the bisections,
+        # so we need to take them into account
+        # (We use the bisection of the bisections as a simplifying assumption)
+        vertical_direction = c_b_backup.bisect(n_b_backup).theta
+
+        # Distribute vertical translations among both axes according to bisection of bisections
+        # (Note how we swapped sin and cos to account for the pi/2 angle of difference)
+        translate_x_l = translate_x_l + translate_l * np.sin(vertical_direction)
+        translate_x_r = translate_x_r + translate_r * np.sin(vertical_direction)
+        translate_y_l = translate_y_l + translate_l * np.cos(vertical_direction)
+        translate_y_r = translate_y_r + translate_r * np.cos(vertical_direction)
+
+        # Take the average over both translation for left and right
+        translate_x = (translate_x_l + translate_x_r) / 2
+        translate_y = (translate_y_l + translate_y_r) / 2
     else:
-        print('Done. Result:')
-        print(df)
-        print('Result not written to disk as output file was not specified.')
+        # We do not take into account that we rotated our lines earlier because experiments show that this produces worse results.
+
+        # Compute how far the current lines
+        # need to be translated in vertical direction
+        # to match the next lines
+        translate_y_l = translate_y_l + n_l.vertical_distance(c_l)
+        translate_y_r = translate_y_r + n_r.vertical_distance(c_r)
+
+        # The only time we translated horizontally was in the beginning, so we just copy that value
+        translate_x = translate_x_l  # = translate_x_r
+        # Take the average over both translation for left and right
+        translate_y = 0.5 * (translate_y_l + translate_y_r)
+
+    # average over all values per pair of images,
+    # summing up one after another just like a mean over each pair would
+    count = np.bincount(owners, minlength=len(line_pairs_list))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack([
+            np.bincount(owners, weights=translate_x, minlength=len(count)) / count,
+            np.bincount(owners, weights=translate_y, minlength=len(count)) / count,
+        ], axis=1)
+
+
+def refine_estimate(estimate, line_pairs, image_height, lInfRadius=50, adaptive=None):
+    """
+    Rounds an estimate of `analytical_estimates` to pixel accuracy
+    and optimizes it locally based on the error function.
+    Given an `AdaptiveRadius`, `lInfRadius` is merely the maximum radius.
+    Returns None if there is no estimate.
+    """
+    if np.isnan(estimate).any():
+        return None
+
+    # round to pixel accuracy
+    translation = np.rint(estimate).astype(int)
+
+    if lInfRadius > 0:
+        center, radius = ((translation, lInfRadius) if adaptive is None
+                          else adaptive.window(translation))
+        # Optimize result based on error function
+        optimum = optimize_line_distances(
+            line_pairs, center, image_height,
+            lInfRadius=radius
+        )
+        # an optimum at the border of a reduced window may continue outside of it
+        if radius < lInfRadius and max(abs(optimum[0] - center[0]),
+                                       abs(optimum[1] - center[1])) == radius:
+            radius = lInfRadius
+            optimum = optimize_line_distances(
+                line_pairs, translation, image_height,
+                lInfRadius=radius
+            )
+        if adaptive is not None:
+            adaptive.add(optimum, radius)
+        translation = optimum
+    return translation
 
 
 def optimize_line_distances(line_pairs, translation, image_height, lInfRadius=50):
     tx, ty = translation
 
-    # move origin of lines
-    # so that we can also compute the error function
-    # based on the bottom border of the image
-    line_pairs_bottom = [(ut.move_origin(c, y=image_height),
-                          ut.move_origin(n, y=image_height))
-                         for c, n in line_pairs]
-
     # create surrounding area around target translation value
     attempts = [(x, y)
                 for x in range(tx - lInfRadius, tx + lInfRadius + 1)
                 for y in range(ty - lInfRadius, ty + lInfRadius + 1)]
 
-    errors = [(translation,
-               compute_error(line_pairs, translation, image_height))
-              for translation in attempts]
+    # evaluate the error function for all attempts at once
+    c, n = line_pairs
+    xs, ys = zip(*attempts)
+    errors = kernels.squared_errors(c.rho, c.theta, n.rho, n.theta,
+                                    xs, ys, image_height)
 
-    return min(errors, key=snd)[0]
+    return attempts[np.argmin(errors)]
 
 
 def compute_error(line_pairs, translation, image_height):
     """
-    Takes a list of line pairs (current lines and next lines)
+    Takes a pair of `LineSet`s (current lines and their twins in the next image)
     as well as a translation (x, y)
     and returns the sum of squared distances of the lines' roots
     at both the top and the bottom border of the image.
     """
     tx, ty = translation
+    c, n = line_pairs
+    return kernels.squared_errors(c.rho, c.theta, n.rho, n.theta,
+                                  [tx], [ty], image_height)[0]
 
-    # [(current at origin of next, next)]
-    translated_lines = ((ut.move_origin(c, x=tx, y=ty),
-                         n)
-                        for c, n in line_pairs)
-
-    # [(current, next, current at bottom border, next at bottom border)]
-    border_lines = ((c,
-                     n,
-                     ut.move_origin(c, y=image_height),
-                     ut.move_origin(n, y=image_height))
-                    for c, n in translated_lines)
 
-    # [(distance current <-> next, ditto at bottom border)]
-    deviations = ((ut.root(n) - ut.root(c),  # top error
-                   ut.root(nb) - ut.root(cb))  # bottom error
-                  for c, n, cb, nb in border_lines)
+class AdaptiveRadius:
+    """
+    `AdaptiveRadius` places the window of local optimization for pairs of images
+    processed in order. The translation of a pair is predicted by the mean of
+    the last `history` translations, and the window around the prediction
+    has `deviations` times their standard deviation as radius (at least
+    `min_radius`). If the estimate lies outside of this window, the window
+    is centered on the estimate instead and widens as far as the estimate
+    disagrees with the prediction (at most `max_radius`).
+    """
 
-    squared_error = (x * x + y * y for x, y in deviations)
+    def __init__(self, max_radius, min_radius=2, history=5, deviations=3):
+        self.max_radius = max_radius
+        self.min_radius = min(min_radius, max_radius)
+        self.history = history
+        self.deviations = deviations
+        self.translations = []
+        self.radii = []
 
-    return sum(squared_error)
+    def window(self, estimate):
+        """
+        Returns the center and the L∞ radius of the window to search for a pair
+        of images, given the rounded estimate of its translation.
+        """
+        if len(self.translations) < 2:
+            return estimate, self.max_radius
+        recent = np.array(self.translations[-self.history:])
+        prediction = np.rint(recent.mean(0)).astype(int)
+        radius = max(int(np.ceil(self.deviations * recent.std(0).max())), self.min_radius)
+        disagreement = np.abs(np.asarray(estimate) - prediction).max()
+        if disagreement <= radius:
+            return prediction, min(radius, self.max_radius)
+        return estimate, min(disagreement + radius, self.max_radius)
+
+    def add(self, translation, radius):
+        """
+        Records the translation of a pair and the radius it was finally searched with.
+        """
+        self.translations.append(tuple(translation))
+        self.radii.append(radius)
 
 
 class LineImage:
     """
-    `LineImage`s contain an image path and a list of Hough lines with it.
+    `LineImage`s contain an image path and a `LineSet` of Hough lines with it.
     Hough lines will automatically be normalized upon instantiation
     as specified by `lineutils.normalize(line)`.
     """
 
     def __init__(self, img_path, lines=[]):
         self.img_path = img_path
-        self.lines = [ut.normalize(l) for l in lines]
-        self.twins = {}
+        self.lines = ut.LineSet.from_lines(lines)
+        self.twins = np.full(len(self.lines), -1)
 
     def init_twins(self, image):
         """
         Takes an image and matches `self.lines` with image.lines to generate
-        pairs of closest lines. Result will be stored in `self.twins` property.
+        pairs of closest lines. Result will be stored in `self.twins` property,
+        holding the index of the twin in image.lines for every line
+        (or -1 if there is none).
         """
         # TODO: find metric that works more generically, create clusters with two elements each
         # print('Finding neighbors for', len(
         #     self.lines), 'lines in', self.img_path)
-        for line in self.lines:
+        self.twins = np.full(len(self.lines), -1)
+        for i, line in enumerate(self.lines):
             # print('Finding neighbor for', line, 'in', image.lines)
 
             # Take lines that are similar and sort them by rho distance
-            neighbors = list(
-                sorted(
-                    filter(
-                        lambda l: ld.ut.are_lines_similar(l, line),
-                        image.lines
-                    ),
-                    # similarity heuristic: compare distances of foot points from origin
-                    key=lambda l: abs(r(line) - r(l))
-                )
-            )
+            neighbors = np.flatnonzero(image.lines.similar_to(line))
+            # similarity heuristic: compare distances of foot points from origin
+            neighbors = neighbors[np.argsort(np.abs(r(line) - image.lines.rho[neighbors]),
+                                             kind='stable')]
             if(len(neighbors) > 0):
                 twin = neighbors[0]
                 if(len(neighbors) > 1):
                     print('WARNING: Ignoring other similar line(s) of',
-                          ut.eq(line), 'besides', ut.eq(twin) + '!', '(', self.img_path, ')')
-                    print([ut.eq(l) for l in neighbors[1:]])
-                self.twins[line] = twin
+                          ut.eq(line), 'besides', ut.eq(image.lines[twin]) + '!', '(', self.img_path, ')')
+                    print([ut.eq(l) for l in image.lines[neighbors[1:]]])
+                self.twins[i] = twin
             else:
                 print('WARNING: Line cannot be found in next image!',
                       ut.eq(line), '(', self.img_path, ')')
@@ -311,23 +703,52 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('method', choices=['analytical', 'iterative'],
-                        help='Perform stitching in an analytical or iterative manner')
+    parser.add_argument('method', choices=['analytical', 'iterative', 'phase'],
+                        help='Perform stitching in an analytical or iterative manner based on Hough lines, or by phase correlation of the images')
     parser.add_argument('hough',
-                        help='File containing precomputed hough lines')
+                        help='File containing precomputed hough lines (supply - to go without iff method=phase)')
     parser.add_argument('input',
                         help='Image directory')
     parser.add_argument('height', type=int,
                         help='Image height')
     parser.add_argument('-l', '--local-optimization', type=int, default=20,
-                        help='Maximum L∞ radius of local optimization (regarded iff method=analytical)')
+                        help='Maximum L∞ radius of local optimization (regarded iff method=analytical or prior tolerance given)')
     parser.add_argument('--reverse-rotation', action='store_true',
                         help='DISCOURAGED. Distribute vertical distance among both axes according to the previous rotation')
     parser.add_argument('-o', '--output',
                         help='Output file')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Write each translation as soon as it is computed, keeping only two images in memory')
+    parser.add_argument('-f', '--follow', type=int, default=0,
+                        help='Wait this many seconds for more Hough lines to be appended (regarded iff stream)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip pairs of images already contained in the output file of an earlier, interrupted run')
+    parser.add_argument('--checkpoint', type=int, default=100,
+                        help='Write the output file every this many pairs of images')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Shrink the radius of local optimization where translations are predictable from the previous ones (regarded iff method=analytical)')
+    parser.add_argument('--phase-scale', type=float, default=0.25,
+                        help='Scaling factor of images before phase correlation (regarded iff method=phase)')
+    parser.add_argument('--prior-tolerance', type=int,
+                        help='Fall back to the analytical result of Hough lines if phase correlation deviates more than this many pixels (regarded iff method=phase)')
 
     args = parser.parse_args()
 
-    stitch(args.method, args.input, args.height, args.hough,
-           lInfRadius=args.local_optimization, reverse_rotation=args.reverse_rotation,
-           output=args.output)
+    if args.hough == '-':
+        if args.method != 'phase' or args.stream:
+            print('Please provide a file containing Hough lines')
+            exit(1)
+        args.hough = None
+
+    if args.stream:
+        stitch_incremental(args.method, args.input, args.height, args.hough,
+                           lInfRadius=args.local_optimization, reverse_rotation=args.reverse_rotation,
+                           output=args.output, follow=args.follow,
+                           phase_scale=args.phase_scale, prior_tolerance=args.prior_tolerance,
+                           adaptive=args.adaptive, resume=args.resume)
+    else:
+        stitch(args.method, args.input, args.height, args.hough,
+               lInfRadius=args.local_optimization, reverse_rotation=args.reverse_rotation,
+               output=args.output, resume=args.resume, checkpoint=args.checkpoint,
+               phase_scale=args.phase_scale, prior_tolerance=args.prior_tolerance,
+               adaptive=args.adaptive)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# Watches a directory that frames keep arriving in (e.g. while still recording
+# in the field) and keeps its Hough lines and translations up to date. Every
+# update detects lines in the new frames only, appends them to the lines file,
+# stitches only the pairs of images that became adjacent by the new frames
+# and appends their translations, so its cost does not grow with the number
+# of frames seen so far. Only frames arriving out of order (i.e. before a frame
+# already seen) make both files be rewritten, so that they stay sorted by file
+# name, as `stitch.py --stream` and the post-processing scripts expect.
+
+import bisect
+import csv
+import io
+import os
+import time
+from concurrent import futures
+
+import pandas as pd
+
+import framestore as fs
+import hough as ld
+import stitch as st
+from lineutils import r, t
+
+
+def ready_files(imagedir, settle=1):
+    """
+    Returns the names of the images in a directory that have not been
+    modified for `settle` seconds, i.e. that are (most likely) written completely.
+    """
+    now = time.time()
+    files = []
+    for entry in os.scandir(imagedir):
+        if (entry.is_file() and entry.name.lower().endswith(fs.IMAGE_EXTENSIONS)
+                and now - entry.stat().st_mtime >= settle):
+            files.append(entry.name)
+    return files
+
+
+def stored_lines(rows):
+    """
+    Returns the lines of rows (file, rho, theta) as they read back from a CSV file,
+    so that they are the very same floats `stitch.py` would work with.
+    """
+    text = pd.DataFrame(sorted(rows), columns=['file', 'rho', 'theta']).to_csv(index=False)
+    df = pd.read_csv(io.StringIO(text))
+    return list(zip(df['rho'], df['theta']))
+
+
+def insert_rows(outputfile, file, rows):
+    """
+    Like `hough.record_rows`, but inserts the rows of a file in order of the
+    file names instead of appending them, by rewriting the CSV file atomically.
+    """
+    with open(outputfile) as f:
+        header, *lines = f.readlines()
+    position = len(lines)
+    for i, line in enumerate(lines):
+        if next(csv.reader([line]))[0] > file:
+            position = i
+            break
+    text = pd.DataFrame(sorted(rows), columns=['file', 'rho', 'theta']
+                        ).to_csv(index=False, header=False)
+    with open(outputfile + '.tmp', 'w') as f:
+        f.writelines([header] + lines[:position] + [text] + lines[position:])
+    os.replace(outputfile + '.tmp', outputfile)
+    with open(ld.progress_file(outputfile), 'a') as f:
+        f.write(file + '\n')
+
+
+class Watcher:
+    """
+    `Watcher`s hold the lines of all images processed so far in order
+    of their file names along with the translations between them.
+    Call `update` with new file names to bring both up to date.
+    """
+
+    def __init__(self, imagedir, houghfile, output=None, image_height=None,
+                 method='iterative', lInfRadius=20, reverse_rotation=False,
+                 detect=ld.hough, max_workers=4, resume=True):
+        self.imagedir = imagedir
+        self.houghfile = houghfile
+        self.output = output
+        self.image_height = image_height
+        self.method = method
+        self.lInfRadius = lInfRadius
+        self.reverse_rotation = reverse_rotation
+        self.detect = detect
+        self.max_workers = max_workers
+
+        self.files = []
+        self.images = {}
+        self.translations = {}
+        # last file in the output file, None if there is no output file yet
+        self.written = None
+
+        # pick up the results of an earlier run
+        done, rows = ld.restore_progress(houghfile) if resume else (set(), [])
+        if done:
+            lines_per_file = {file: [] for file in done}
+            for file, rho, theta in rows:
+                lines_per_file[file].append((rho, theta))
+            for file, lines in lines_per_file.items():
+                self.add(file, lines)
+            if output is not None and os.path.isfile(output):
+                self.translations = st.read_translations(output)
+                self.written = max(self.translations, default='')
+            print('Resuming after', len(done), 'completed file(s)')
+            # stitch pairs that were not completed before
+            self.save(self.stitch(range(len(self.files) - 1)))
+        else:
+            ld.append_rows(houghfile, [], header=True)
+            open(ld.progress_file(houghfile), 'w').close()
+
+    def __contains__(self, file):
+        return file in self.images
+
+    def add(self, file, lines):
+        """
+        Adds the lines of an image, keeping the images in order.
+        """
+        self.images[file] = st.LineImage(os.path.join(self.imagedir, file), lines)
+        bisect.insort(self.files, file)
+
+    def lines_of(self, file):
+        rows = []
+        for line in self.detect(os.path.join(self.imagedir, file)):
+            rows.append([file, r(line), t(line)])
+        return rows
+
+    def stitch(self, indices):
+        """
+        Computes the translations of the pairs of images starting at the given
+        indices, unless they are known already, and returns the files whose
+        translations were computed.
+        """
+        stitched = []
+        for i in sorted(set(indices)):
+            if i < 0 or i + 1 >= len(self.files):
+                continue
+            file, ref = self.files[i], self.files[i + 1]
+            if file in self.translations and self.translations[file][0] == ref:
+                continue
+            if self.image_height is None:
+                # the image height is only known once there are images
+                self.image_height = fs.imread(os.path.join(self.imagedir, file)).shape[0]
+            translation = st.solve_pair(self.method, self.images[file], self.images[ref],
+                                        self.image_height,
+                                        lInfRadius=self.lInfRadius,
+                                        reverse_rotation=self.reverse_rotation)
+            self.translations[file] = (ref, translation)
+            if self.output is None:
+                print(file, ref, *translation, sep=',')
+            stitched.append(file)
+        return stitched
+
+    def save(self, files):
+        """
+        Writes the translations of the given files to the output file.
+        They are appended if they all belong after the translations in it,
+        otherwise the output file is rewritten.
+        """
+        if self.output is None or not files:
+            return
+        if self.written is None or min(files) <= self.written:
+            st.write_translations(self.translations, self.output)
+        else:
+            st.translations_frame({file: self.translations[file] for file in files}
+                                  ).to_csv(self.output, mode='a', header=False)
+        self.written = max(self.translations)
+
+    def update(self, files):
+        """
+        Detects lines in the given new images and stitches the pairs of images
+        they are part of. Returns the number of pairs stitched.
+        """
+        files = sorted(file for file in files if file not in self)
+        if not files:
+            return 0
+
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+            for file, rows in zip(files, ex.map(self.lines_of, files)):
+                if self.files and file < self.files[-1]:
+                    insert_rows(self.houghfile, file, rows)
+                else:
+                    ld.record_rows(self.houghfile, file, rows)
+                self.add(file, stored_lines(rows))
+
+        # positions of earlier images shift as images are inserted before them
+        indices = [bisect.bisect_left(self.files, file) for file in files]
+        stitched = self.stitch([j for i in indices for j in (i - 1, i)])
+        self.save(stitched)
+        return len(stitched)
+
+
+def watch(imagedir, houghfile, output=None, image_height=None,
+          method='iterative', lInfRadius=20, reverse_rotation=False,
+          detect=ld.hough, max_workers=4, interval=2, settle=1, timeout=None, resume=True):
+    """
+    Polls `imagedir` every `interval` seconds for new images, see `Watcher`.
+    Stops once no new images arrived for `timeout` seconds
+    (or on keyboard interrupt if `timeout` is None).
+    """
+    watcher = Watcher(imagedir, houghfile, output=output, image_height=image_height,
+                      method=method, lInfRadius=lInfRadius, reverse_rotation=reverse_rotation,
+                      detect=detect, max_workers=max_workers, resume=resume)
+    print('Watching', imagedir)
+    idle = 0
+    try:
+        while True:
+            new = [file for file in ready_files(imagedir, settle) if file not in watcher]
+            if new:
+                start = time.time()
+                count = watcher.update(new)
+                print('Processed', len(new), 'new image(s) and', count, 'pair(s) in',
+                      round(time.time() - start, 2), 's,', len(watcher.files), 'image(s) in total')
+                idle = 0
+            elif timeout is not None and idle >= timeout:
+                break
+            else:
+                time.sleep(interval)
+                idle += interval
+    except KeyboardInterrupt:
+        pass
+
+    print('Done.', houghfile, output if output is not None else '')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('input',
+                        help='Image directory to watch')
+    parser.add_argument('height', type=int, nargs='?',
+                        help='Image height (taken from the first image if omitted)')
+    parser.add_argument('-o', '--output',
+                        help='Output file of translations (printed if omitted)')
+    parser.add_argument('--hough',
+                        help='Output csv of Hough lines (default: hough.csv in input directory)')
+    parser.add_argument('-m', '--method', choices=['analytical', 'iterative', 'phase'], default='iterative',
+                        help='Perform stitching in an analytical or iterative manner based on Hough lines, or by phase correlation of the images')
+    parser.add_argument('-l', '--local-optimization', type=int, default=20,
+                        help='Maximum L∞ radius of local optimization (regarded iff method=analytical)')
+    parser.add_argument('--reverse-rotation', action='store_true',
+                        help='DISCOURAGED. Distribute vertical distance among both axes according to the previous rotation')
+    parser.add_argument('-s', '--strategy', default='center', choices=['center', 'nub', 'none', 'rows'],
+                        help='Use center of lines close to each other or filter out similar lines, or fit blade edges per row instead of Hough')
+    parser.add_argument('-t', '--threshold', type=int, default=80,
+                        help='Threshold to use for Hough transformation')
+    parser.add_argument('-g', '--min-gradient', type=int, default=20,
+                        help='Minimum horizontal gradient of blade edges (regarded iff strategy=rows)')
+    parser.add_argument('-d', '--max-v-deviation', type=float,
+                        help='Filter lines by their maximum deviation from the vertical line (recommendation: 0.3)')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='Maximum number of threads to use')
+    parser.add_argument('-i', '--interval', type=float, default=2,
+                        help='Seconds between polls of the input directory')
+    parser.add_argument('--settle', type=float, default=1,
+                        help='Seconds an image must not have been modified to be considered complete')
+    parser.add_argument('--timeout', type=float,
+                        help='Stop after this many seconds without new images (default: run until interrupted)')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard the results of an earlier run instead of continuing it')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        print('Please provide an image directory')
+        exit(1)
+
+    filterPredicate = ((lambda l: ld.naiveFilter(l, args.max_v_deviation))
+                       if args.max_v_deviation is not None else None)
+    if args.strategy == 'rows':
+        def detect(imagefile):
+            return ld.rowedges(imagefile, min_gradient=args.min_gradient,
+                               filterPredicate=filterPredicate)
+    else:
+        def detect(imagefile):
+            return ld.hough(imagefile, threshold=args.threshold,
+                            filterPredicate=filterPredicate,
+                            center=args.strategy == 'center',
+                            nubPredicate=ld.naiveNubPredicate
+                            if args.strategy == 'nub' else None)
+
+    watch(args.input, args.hough or os.path.join(args.input, 'hough.csv'),
+          output=args.output,
+          image_height=args.height,
+          method=args.method,
+          lInfRadius=args.local_optimization,
+          reverse_rotation=args.reverse_rotation,
+          detect=detect,
+          max_workers=args.max_workers,
+          interval=args.interval,
+          settle=args.settle,
+          timeout=args.timeout,
+          resume=not args.restart)
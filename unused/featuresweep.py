@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import lineutils as ut
+import stitch as st
+
+# SIFT moved to the main module in OpenCV 4.4
+SIFT_create = cv.SIFT_create if hasattr(cv, 'SIFT_create') else cv.xfeatures2d.SIFT_create
+
+
+def gftt_responses(gray, minquality, mindist, mask=None):
+    """
+    Detects Good Features to Track with an unlimited number of features
+    and returns the responses (minimal eigenvalues) of the features
+    in the order they were selected, as well as the maximum response.
+    """
+    if mask is not None and not mask.any():
+        mask = None
+    corners = cv.goodFeaturesToTrack(gray, 0, minquality, mindist, mask=mask)
+    eig = cv.cornerMinEigenVal(gray, 3)
+    max_eig = eig[mask > 0].max() if mask is not None else eig.max()
+    if corners is None:
+        return np.array([]), max_eig
+    xs, ys = np.int32(corners.reshape(-1, 2)).T
+    return eig[ys, xs], max_eig
+
+
+def gftt_sweep(imagedir, output, counts, qualities, mindist=10, masks=None):
+    """
+    Evaluates Good Features to Track for all combinations of
+    feature counts and quality levels. Features are detected only once per
+    image with the lowest quality level. As features are selected greedily
+    in order of their response, the features of any higher quality level are
+    the prefix of those above the respective threshold,
+    and the features of any count are the prefix of that length.
+    """
+    files = sorted(os.listdir(imagedir))
+    min_quality = min(qualities)
+    masks = masks or {}
+
+    detections = []
+    for file in tqdm(files):
+        img = cv.imread(os.path.join(imagedir, file))
+        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+        detections.append(gftt_responses(gray, min_quality, mindist,
+                                         mask=masks.get(file)))
+
+    rows = []
+    for quality in qualities:
+        # number of features above quality level per image
+        found = np.array([(responses > quality * max_eig).sum()
+                          for responses, max_eig in detections])
+        for count in counts:
+            features = np.minimum(found, count) if count > 0 else found
+            rows.append([count, quality, *summarize(features)])
+
+    df = pd.DataFrame(rows, columns=['count', 'quality',
+                                     'features', 'mean', 'min', 'max'])
+    df.to_csv(output, index=False)
+    print('Done.', output)
+
+
+def sift_sweep(imagedir, output, counts, contrast_thresholds, edge_thresholds,
+               layers=3, masks=None):
+    """
+    Evaluates SIFT for all combinations of feature counts, contrast thresholds
+    and edge thresholds. Features are detected only once per image and edge
+    threshold with the lowest contrast threshold. Keypoints are rejected
+    by the contrast threshold based on their response,
+    and limiting the count retains the keypoints with the highest responses,
+    so both can be derived from the detected keypoints.
+    """
+    files = sorted(os.listdir(imagedir))
+    min_contrast = min(contrast_thresholds)
+    masks = masks or {}
+
+    # responses[edge threshold][image]
+    responses = {et: [] for et in edge_thresholds}
+    for file in tqdm(files):
+        img = cv.imread(os.path.join(imagedir, file))
+        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+        for et in edge_thresholds:
+            sift = SIFT_create(nOctaveLayers=layers,
+                               contrastThreshold=min_contrast,
+                               edgeThreshold=et)
+            kp = sift.detect(gray, masks.get(file))
+            responses[et].append(np.array([k.response for k in kp]))
+
+    rows = []
+    for et in edge_thresholds:
+        for ct in contrast_thresholds:
+            found = np.array([(r * layers >= ct).sum()
+                              for r in responses[et]])
+            for count in counts:
+                features = np.minimum(found, count) if count > 0 else found
+                rows.append([count, ct, et, *summarize(features)])
+
+    df = pd.DataFrame(rows, columns=['count', 'contrast_threshold', 'edge_threshold',
+                                     'features', 'mean', 'min', 'max'])
+    df.to_csv(output, index=False)
+    print('Done.', output)
+
+
+def summarize(features):
+    if not len(features):
+        return 0, 0, 0, 0
+    return features.sum(), features.mean(), features.min(), features.max()
+
+
+def read_masks(hough, imagedir):
+    """
+    Creates a blade mask for every image with at least two Hough lines
+    based on a CSV file of them. Other images are not masked.
+    """
+    df = pd.read_csv(hough)
+    masks = {}
+    for file, group_df in df.groupby(by='file'):
+        lines = ut.LineSet.from_lines(zip(group_df['rho'], group_df['theta']))
+        if len(lines) < 2:
+            continue
+        img = cv.imread(os.path.join(imagedir, file), 0)
+        mask = st.blade_mask(img.shape, lines)
+        if mask.any():
+            masks[file] = mask.astype(np.uint8) * 255
+    return masks
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('method', choices=['gftt', 'sift'],
+                        help='Feature detector to evaluate')
+    parser.add_argument('input', help='Image directory')
+    parser.add_argument('output', help='Output CSV file')
+    parser.add_argument('-c', '--counts', type=int, nargs='+', default=[0, 25],
+                        help='Numbers of features to detect, 0 means unlimited')
+    parser.add_argument('-q', '--qualities', type=float, nargs='+', default=[0.01],
+                        help='Minimal quality levels (regarded iff method=gftt)')
+    parser.add_argument('-d', '--distance', type=int, default=10,
+                        help='Minimal distance between features (regarded iff method=gftt)')
+    parser.add_argument('--contrast-thresholds', type=float, nargs='+', default=[0.04],
+                        help='Contrast thresholds (regarded iff method=sift)')
+    parser.add_argument('--edge-thresholds', type=float, nargs='+', default=[10],
+                        help='Edge thresholds (regarded iff method=sift)')
+    parser.add_argument('--hough',
+                        help='CSV file containing Hough lines to restrict detection to the blade')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        print('Please prove a directory containing the image files')
+        exit(1)
+
+    masks = read_masks(args.hough, args.input) if args.hough else {}
+
+    if args.method == 'gftt':
+        gftt_sweep(args.input, args.output, args.counts, args.qualities,
+                   mindist=args.distance, masks=masks)
+    else:
+        sift_sweep(args.input, args.output, args.counts,
+                   args.contrast_thresholds, args.edge_thresholds, masks=masks)
@@ -10,12 +10,17 @@
 
 
 import os
+import sys
 
 import cv2 as cv
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
 import lineutils as ut
 from lineutils import r, t, x, y
 
@@ -59,8 +64,8 @@ def tmatch(hough, stitch, inputdir, method, outputfile=None,
 
         lines = lines_per_file[ref_name]
 
-        img = cv.imread(os.path.join(inputdir, file_name), 0)
-        ref = cv.imread(os.path.join(inputdir, ref_name), 0)
+        img = fs.imread(os.path.join(inputdir, file_name), 0)
+        ref = fs.imread(os.path.join(inputdir, ref_name), 0)
 
         img_w, img_h = img.shape[1], img.shape[0]
         ref_w, ref_h = ref.shape[1], ref.shape[0]
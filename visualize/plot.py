@@ -2,15 +2,38 @@
 # -*- coding: utf8 -*-
 
 import os
+from concurrent import futures
 
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
 
-def plot(file, xlabel, ylabel, color='Blues', dpi=None, output=None):
+def downsample(df, max_size=None):
+    """
+    Aggregates blocks of adjacent cells by their mean such that
+    neither axis of the given matrix exceeds `max_size` entries.
+    Every block is labelled by its first row and column, respectively.
+    """
+    if max_size is None:
+        return df
+    row_factor = int(np.ceil(len(df.index) / max_size))
+    col_factor = int(np.ceil(len(df.columns) / max_size))
+    if row_factor > 1:
+        blocks = np.arange(len(df.index)) // row_factor
+        df = df.groupby(blocks).mean().set_axis(df.index[::row_factor],
+                                                axis=0)
+    if col_factor > 1:
+        blocks = np.arange(len(df.columns)) // col_factor
+        df = df.T.groupby(blocks).mean().set_axis(df.columns[::col_factor],
+                                                  axis=0).T
+    return df
+
+
+def plot(file, xlabel, ylabel, color='Blues', dpi=None, output=None, max_size=None):
     print('Loading data file')
-    df = pd.read_csv(file, index_col=0)
+    df = downsample(pd.read_csv(file, index_col=0), max_size)
     print('Plotting', file)
     sns.set()
     sns.heatmap(cmap=color, data=df)
@@ -25,13 +48,68 @@ def plot(file, xlabel, ylabel, color='Blues', dpi=None, output=None):
         plt.savefig(output, dpi=dpi)
 
 
+def render(file, output, xlabel, ylabel, color='Blues', dpi=None, max_size=None):
+    """
+    Renders a single heatmap to a file on its own figure.
+    """
+    df = downsample(pd.read_csv(file, index_col=0), max_size)
+    fig, ax = plt.subplots()
+    sns.heatmap(cmap=color, data=df, ax=ax)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.tick_params(axis='y', rotation=0)
+    fig.savefig(output, dpi=dpi)
+    plt.close(fig)
+    return output
+
+
+def init_worker():
+    # Worker processes never show any windows
+    plt.switch_backend('Agg')
+    sns.set()
+
+
+def output_names(files):
+    """
+    Returns the names of the PNG files of the given input files. Those are
+    named after their input file, prefixed by its directory if another
+    input file has the same name.
+    """
+    names = [os.path.splitext(os.path.basename(file))[0] for file in files]
+    names = [os.path.basename(os.path.dirname(os.path.abspath(file))) + '_' + name
+             if names.count(name) > 1 else name
+             for file, name in zip(files, names)]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError('Input files would overwrite each other as ' + ', '.join(duplicates))
+    return [name + '.png' for name in names]
+
+
+def plot_all(files, outputdir, xlabel, ylabel, color='Blues', dpi=None, max_size=None,
+             max_workers=4):
+    """
+    Renders heatmaps of many files in parallel without showing them,
+    storing each one as a PNG file named after its input file,
+    see `output_names`.
+    """
+    outputs = [os.path.join(outputdir, name) for name in output_names(files)]
+    with futures.ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=init_worker) as ex:
+        jobs = [ex.submit(render, file, output, xlabel, ylabel,
+                          color=color, dpi=dpi, max_size=max_size)
+                for file, output in zip(files, outputs)]
+        for job in futures.as_completed(jobs):
+            print('Saved', job.result())
+    print('Done.', outputdir)
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('data',
-                        help='Input file')
+    parser.add_argument('data', nargs='+',
+                        help='Input file(s)')
     parser.add_argument('xlabel',
                         help='Label for x axis')
     parser.add_argument('ylabel',
@@ -42,14 +120,33 @@ if __name__ == '__main__':
                         help='Dpi to use')
     parser.add_argument('-o', '--output',
                         help='Store output')
+    parser.add_argument('-b', '--batch',
+                        help='Render all input files to this directory without showing them')
+    parser.add_argument('-m', '--max-size', type=int,
+                        help='Aggregate matrices so that neither axis exceeds this size')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='Maximum number of processes to use (regarded iff batch)')
 
     args = parser.parse_args()
 
-    if not os.path.isfile(args.data):
-        print('Please prove a file')
-        exit(1)
+    for file in args.data:
+        if not os.path.isfile(file):
+            print('Please prove a file')
+            exit(1)
 
-    plot(args.data, args.xlabel, args.ylabel,
-         color=args.color,
-         dpi=args.dpi,
-         output=args.output)
+    if args.batch:
+        os.makedirs(args.batch, exist_ok=True)
+        plot_all(args.data, args.batch, args.xlabel, args.ylabel,
+                 color=args.color,
+                 dpi=args.dpi,
+                 max_size=args.max_size,
+                 max_workers=args.max_workers)
+    elif len(args.data) > 1:
+        print('Please supply a directory via --batch to plot multiple files')
+        exit(2)
+    else:
+        plot(args.data[0], args.xlabel, args.ylabel,
+             color=args.color,
+             dpi=args.dpi,
+             output=args.output,
+             max_size=args.max_size)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+import json
+import os
+import sys
+from concurrent import futures
+
+import cv2 as cv
+import numpy as np
+from tqdm import tqdm
+
+# shared modules live in the stitch directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, 'stitch'))
+import framestore as fs
+
+
+def modified(imagefile):
+    """
+    Returns the modification time of an image file or of the frame store it is part of.
+    """
+    directory = os.path.dirname(imagefile)
+    if fs.is_store(directory):
+        return os.path.getmtime(os.path.join(directory, 'frames.npy'))
+    return os.path.getmtime(imagefile)
+
+
+def pyramid(imagefile, outputdir, thumb_size=256, tile_size=512, quality=80):
+    """
+    Writes a thumbnail of the given image as well as a tiled
+    multi-resolution version of it. Level 0 holds the image in full
+    resolution, every following level halves its size until the whole
+    image fits into a single tile. Tiles are stored as
+    `tiles/<level>/<row>_<col>.jpg` inside of `outputdir`.
+    Returns a dict describing the result.
+    """
+    img = fs.imread(imagefile)
+    if img is None:
+        raise ValueError('Could not read image ' + imagefile)
+    img_w, img_h = img.shape[1], img.shape[0]
+    params = [cv.IMWRITE_JPEG_QUALITY, quality]
+
+    os.makedirs(outputdir, exist_ok=True)
+
+    # Thumbnail
+    factor = min(1, thumb_size / max(img_w, img_h))
+    thumb = cv.resize(img, None, fx=factor, fy=factor,
+                      interpolation=cv.INTER_AREA)
+    cv.imwrite(os.path.join(outputdir, 'thumbnail.jpg'), thumb, params)
+
+    # Tiles
+    level = 0
+    while True:
+        level_dir = os.path.join(outputdir, 'tiles', str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        h, w = img.shape[:2]
+        for row in range(int(np.ceil(h / tile_size))):
+            for col in range(int(np.ceil(w / tile_size))):
+                tile = img[row * tile_size:(row + 1) * tile_size,
+                           col * tile_size:(col + 1) * tile_size]
+                cv.imwrite(os.path.join(level_dir, '{}_{}.jpg'.format(row, col)),
+                           tile, params)
+        if max(w, h) <= tile_size:
+            break
+        img = cv.resize(img, ((w + 1) // 2, (h + 1) // 2),
+                        interpolation=cv.INTER_AREA)
+        level += 1
+
+    return {
+        'width': img_w,
+        'height': img_h,
+        'levels': level + 1,
+        'mtime': modified(imagefile),
+    }
+
+
+def pyramid_all(imagedirs, output, thumb_size=256, tile_size=512, quality=80,
+                max_workers=4):
+    """
+    Creates thumbnails and tiles for all images in the given directories
+    and writes an index to `output/index.json`. Images that did not change
+    since the last run (as recorded in an existing index) are skipped,
+    as are images that cannot be read.
+    """
+    index_file = os.path.join(output, 'index.json')
+    index = {'thumb_size': thumb_size, 'tile_size': tile_size, 'images': {}}
+    if os.path.isfile(index_file):
+        with open(index_file) as f:
+            previous = json.load(f)
+        # results can only be reused if they were created with the same sizes
+        if (previous['thumb_size'], previous['tile_size']) == (thumb_size, tile_size):
+            index['images'] = previous['images']
+
+    jobs = {}
+    failed = 0
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as ex:
+        for imagedir in imagedirs:
+            label = os.path.basename(os.path.normpath(imagedir))
+            for file in sorted(fs.list_images(imagedir)):
+                key = label + '/' + file
+                imagefile = os.path.join(imagedir, file)
+                entry = index['images'].get(key)
+                if entry is not None and entry['mtime'] == modified(imagefile):
+                    continue
+                jobs[ex.submit(pyramid, imagefile, os.path.join(output, key),
+                               thumb_size=thumb_size,
+                               tile_size=tile_size,
+                               quality=quality)] = key
+
+        for job in tqdm(futures.as_completed(jobs), total=len(jobs)):
+            key = jobs[job]
+            try:
+                entry = job.result()
+            except Exception as e:
+                print('WARNING: Skipping', key + ':', e)
+                failed += 1
+                continue
+            entry['thumbnail'] = key + '/thumbnail.jpg'
+            entry['tiles'] = key + '/tiles'
+            index['images'][key] = entry
+
+    with open(index_file, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    print('Updated', len(jobs) - failed, 'image(s), skipped', failed, 'image(s).',
+          'Done.', index_file)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('input', nargs='+',
+                        help='Image directories, e.g. original, padded and reference images')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output directory')
+    parser.add_argument('-t', '--thumb-size', type=int, default=256,
+                        help='Maximum width and height of thumbnails')
+    parser.add_argument('-s', '--tile-size', type=int, default=512,
+                        help='Width and height of tiles')
+    parser.add_argument('-q', '--quality', type=int, default=80,
+                        help='JPEG quality of thumbnails and tiles')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='Maximum number of processes to use')
+
+    args = parser.parse_args()
+
+    for imagedir in args.input:
+        if not os.path.isdir(imagedir):
+            print('Please prove directories containing the image files')
+            exit(1)
+
+    os.makedirs(args.output, exist_ok=True)
+    pyramid_all(args.input, args.output,
+                thumb_size=args.thumb_size,
+                tile_size=args.tile_size,
+                quality=args.quality,
+                max_workers=args.max_workers)
@@ -0,0 +1,68 @@
+/*
+ * Before/after image slider with the interface of the TwentyTwenty component
+ * of vue-twentytwenty (props before, after, offset, keyboardStep, beforeLabel
+ * and afterLabel), kept next to imagecompare.html so that it works offline.
+ * Registers itself with the global Vue.
+ */
+(function (Vue) {
+    var TwentyTwenty = {
+        props: {
+            before: String,
+            after: String,
+            offset: { type: [String, Number], default: 0.5 },
+            keyboardStep: { type: [String, Number], default: 0.2 },
+            beforeLabel: String,
+            afterLabel: String
+        },
+        data: function () {
+            return {
+                position: Math.min(1, Math.max(0, Number(this.offset))),
+                dragging: false
+            };
+        },
+        methods: {
+            moveTo: function (clientX) {
+                var rect = this.$el.getBoundingClientRect();
+                if (rect.width) {
+                    this.position = Math.min(1, Math.max(0, (clientX - rect.left) / rect.width));
+                }
+            },
+            start: function (e) {
+                this.dragging = true;
+                this.$el.setPointerCapture(e.pointerId);
+                this.moveTo(e.clientX);
+            },
+            move: function (e) {
+                if (this.dragging) {
+                    this.moveTo(e.clientX);
+                }
+            },
+            end: function () {
+                this.dragging = false;
+            },
+            key: function (e) {
+                var step = Number(this.keyboardStep);
+                if (e.key === 'ArrowLeft') {
+                    this.position = Math.max(0, this.position - step);
+                } else if (e.key === 'ArrowRight') {
+                    this.position = Math.min(1, this.position + step);
+                }
+            }
+        },
+        template:
+            '<div class="twentytwenty-container" tabindex="0"' +
+            ' @pointerdown.prevent="start" @pointermove="move" @pointerup="end" @pointercancel="end"' +
+            ' @keydown="key">' +
+            '<img :src="after" alt="after" />' +
+            '<img :src="before" alt="before" class="twentytwenty-before"' +
+            ' :style="{ clipPath: \'inset(0 \' + (100 - position * 100) + \'% 0 0)\' }" />' +
+            '<div v-if="beforeLabel" class="twentytwenty-label twentytwenty-before-label">{{ beforeLabel }}</div>' +
+            '<div v-if="afterLabel" class="twentytwenty-label twentytwenty-after-label">{{ afterLabel }}</div>' +
+            '<div class="twentytwenty-handle" :style="{ left: position * 100 + \'%\' }"></div>' +
+            '</div>'
+    };
+
+    Vue.component('TwentyTwenty', TwentyTwenty);
+    // in-DOM templates lowercase the tag name
+    Vue.component('twentytwenty', TwentyTwenty);
+})(window.Vue);